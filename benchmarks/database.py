@@ -0,0 +1,275 @@
+"""Database microbenchmarks.
+
+Times every public Database method against a populated SQLite file, one call
+at a time and with several callers sharing the pool:
+
+    python -m benchmarks.database --users 100k --deliveries 1m --concurrency 1,16 --json > db.json
+
+The file is seeded once and kept with --db, so bigger histories only cost the
+seeding time on the first run. Write cases claim fresh gift and user ids, a
+kept file grows a little with every run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+
+from collections import Counter
+from dataclasses import dataclass
+from time import perf_counter, time
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+import sqlalchemy
+
+from sqlalchemy import func, select
+
+from benchmarks.seed import FIRST_USER_ID, history_gift_ids, parse_count, seed_history, seed_users
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+from src.data.database.models import GiftDelivery, Invoice, User
+from src.utils import BalanceOperation
+
+
+@dataclass
+class Case:
+    name: str
+    call: Callable[[int, Any], Awaitable[Any]] # (call number, prepared) -> awaitable
+    prepare: Optional[Callable[[int], Awaitable[Any]]] = None # untimed, runs right before the call
+    heavy: bool = False # full scans, run iterations // 20 times
+    write: bool = False
+
+
+def build_cases(database: Database, meta: dict[str, Any], seed: int) -> list[Case]:
+    rng = random.Random(seed)
+    users, invoices = meta["users"], meta["invoices"]
+    gift_ids = history_gift_ids(meta["gifts"])
+    # fresh ids per run so a kept file never collides with an earlier run
+    run = int(time() * 1000) % 10**9
+    new_gifts = itertools.count(7_000_000_000_000_000_000 + run * 10**6)
+    new_users = itertools.count(10**12 + run * 10**6)
+
+    def user() -> int:
+        return FIRST_USER_ID + rng.randrange(users)
+
+    def invoice() -> int:
+        return rng.randint(1, max(1, invoices))
+
+    def delivery() -> int:
+        return rng.randint(1, max(1, meta["deliveries"]))
+
+    async def reserved(i: int) -> Optional[int]:
+        return await database.reserve_purchase(next(new_gifts), user(), 1)
+
+    async def reserved_batch(i: int) -> list[int]:
+        rows = await database.reserve_gift_batch(next(new_gifts), 1, user_ids=[user() for _ in range(100)])
+        return [delivery_id for delivery_id, _ in rows]
+
+    return [
+        # reads
+        Case('load_user_index', lambda i, _: database.load_user_index(), heavy=True),
+        Case('get_user_snapshot', lambda i, _: database.get_user_snapshot(100), heavy=True),
+        Case('get_user', lambda i, _: database.get_user(user())),
+        Case('get_cached_user', lambda i, _: database.get_cached_user(user())),
+        Case('get_user_count', lambda i, _: database.get_user_count()),
+        Case('get_total_balance', lambda i, _: database.get_total_balance()),
+        Case('get_total_gifts', lambda i, _: database.get_total_gifts()),
+        Case('get_gift_delivery', lambda i, _: database.get_gift_delivery(rng.choice(gift_ids), user())),
+        Case('get_pending_deliveries', lambda i, _: database.get_pending_deliveries(), heavy=True),
+        Case('is_invoice_pending', lambda i, _: database.is_invoice_pending(invoice())),
+        # writes
+        Case('create_user', lambda i, _: database.create_user(next(new_users), 100), write=True),
+        Case('update_balance', lambda i, _: database.update_balance(user(), 1, BalanceOperation.ADD), write=True),
+        Case('grant_vip', lambda i, _: database.grant_vip(user(), rng.random() < 0.1), write=True),
+        Case('user_buy_gift', lambda i, _: database.user_buy_gift(1, user()), write=True),
+        Case('create_invoice', lambda i, _: database.create_invoice(100), write=True),
+        Case('additional_message_id_invoice', lambda i, _: database.additional_message_id_invoice(invoice(), i), write=True),
+        Case('get_invoice_message_id', lambda i, _: database.get_invoice_message_id(invoice(), True), write=True),
+        Case('create_gift_delivery', lambda i, _: database.create_gift_delivery(next(new_gifts), user()), write=True),
+        Case('mark_gift_delivered', lambda i, _: database.mark_gift_delivered(delivery()), write=True),
+        Case('reserve_purchase', lambda i, _: database.reserve_purchase(next(new_gifts), user(), 1), write=True),
+        Case('reserve_gift_batch', lambda i, _: database.reserve_gift_batch(
+            next(new_gifts), 1, user_ids=[user() for _ in range(100)]
+        ), write=True),
+        Case('mark_dispatched', lambda i, _: database.mark_dispatched(delivery()), write=True),
+        Case('commit_delivery', lambda i, _: database.commit_delivery(delivery()), write=True),
+        Case('commit_deliveries', lambda i, _: database.commit_deliveries([delivery() for _ in range(100)]), write=True),
+        Case('release_purchase', lambda i, delivery_id: database.release_purchase(delivery_id or 0),
+             prepare=reserved, write=True),
+        Case('release_deliveries', lambda i, delivery_ids: database.release_deliveries(delivery_ids),
+             prepare=reserved_batch, write=True),
+    ]
+
+
+async def measure(case: Case, iterations: int, concurrency: int) -> dict[str, Any]:
+    latencies: list[float] = []
+    errors = Counter()
+    calls = itertools.count()
+
+    async def worker():
+        for i in iter(lambda: next(calls), None):
+            if i >= iterations:
+                return
+            prepared = await case.prepare(i) if case.prepare is not None else None
+            started = perf_counter()
+            try:
+                await case.call(i, prepared)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            latencies.append(perf_counter() - started)
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = perf_counter() - started
+
+    result = {
+        "method": case.name,
+        "kind": "write" if case.write else "read",
+        "concurrency": concurrency,
+        "iterations": iterations,
+        "errors": dict(errors),
+        "wall_seconds": round(wall, 4),
+        "ops_per_second": None,
+        "mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None
+    }
+    if latencies:
+        ms = np.asarray(latencies) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        result.update(
+            # with a prepare step the wall time includes it, the rate comes from the calls alone
+            ops_per_second=round(len(ms) / (wall if case.prepare is None else ms.sum() / 1000 / concurrency), 1),
+            mean_ms=round(float(ms.mean()), 3), p50_ms=round(float(p50), 3), p95_ms=round(float(p95), 3),
+            p99_ms=round(float(p99), 3), max_ms=round(float(ms.max()), 3)
+        )
+    return result
+
+
+async def populate(database: Database, args: argparse.Namespace) -> dict[str, Any]:
+    # seeds an empty file, a kept one is described as it is
+    await database.init_db()
+    async with database.async_session() as session:
+        users = await session.scalar(select(func.count(User.id)))
+
+    seed_seconds = None
+    if not users:
+        started = perf_counter()
+        await seed_users(database, args.users, args.seed)
+        await seed_history(database, args.deliveries, args.users, args.gifts, args.invoices, args.seed)
+        seed_seconds = round(perf_counter() - started, 2)
+
+    async with database.async_session() as session:
+        meta = {
+            "users": await session.scalar(select(func.count(User.id))),
+            "deliveries": await session.scalar(select(func.max(GiftDelivery.id))) or 0,
+            "invoices": await session.scalar(select(func.max(Invoice.invoice_id))) or 0,
+            "gifts": args.gifts,
+            "seed_seconds": seed_seconds
+        }
+    if meta["users"] < args.users:
+        # ids are picked from the seeded range
+        raise RuntimeError(f'{args.db} holds {meta["users"]} users, fewer than --users {args.users}')
+    meta["users"] = args.users
+    return meta
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    workdir = None
+    if args.db is None:
+        workdir = tempfile.TemporaryDirectory(prefix='db-bench-')
+        args.db = os.path.join(workdir.name, 'bench.sqlite')
+
+    config = DatabaseConfig(
+        url=f'sqlite+aiosqlite:///{args.db}',
+        profile=args.profile,
+        pool_size=args.pool_size,
+        user_index=args.user_index
+    )
+    database = Database(config)
+    meta = await populate(database, args)
+    if args.user_index:
+        await database.load_user_index()
+
+    cases = build_cases(database, meta, args.seed)
+    if args.methods:
+        wanted = set(args.methods.split(','))
+        cases = [case for case in cases if case.name in wanted]
+    if not args.user_index:
+        # loading it would switch the other cases over to the index
+        cases = [case for case in cases if case.name != 'load_user_index']
+
+    results = []
+    for concurrency in args.concurrency:
+        for case in cases:
+            iterations = max(3, args.iterations // 20) if case.heavy else args.iterations
+            if args.warmup:
+                await measure(case, min(args.warmup, iterations), 1)
+            result = await measure(case, iterations, concurrency)
+            results.append(result)
+            if not args.json:
+                print_result(result)
+
+    await database.close()
+    output = {
+        "meta": {
+            **meta,
+            "db_bytes": sum(
+                os.path.getsize(path) for path in (args.db, f'{args.db}-wal') if os.path.exists(path)
+            ),
+            "profile": args.profile,
+            "pool_size": args.pool_size,
+            "user_index": args.user_index,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "results": results
+    }
+    if workdir is not None:
+        workdir.cleanup()
+    return output
+
+
+def print_result(result: dict[str, Any]) -> None:
+    errors = f'  errors {result["errors"]}' if result["errors"] else ''
+    print(
+        f'{result["method"]:<30} c={result["concurrency"]:<3} {result["kind"]:<5} '
+        f'{result["ops_per_second"] or 0:>10.1f}/s  p50 {result["p50_ms"] or 0:>8.3f}ms  '
+        f'p99 {result["p99_ms"] or 0:>8.3f}ms  max {result["max_ms"] or 0:>8.3f}ms{errors}',
+        flush=True
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.database', description='Database method microbenchmarks')
+    parser.add_argument('--users', type=parse_count, default=parse_count('10k'))
+    parser.add_argument('--deliveries', type=parse_count, default=parse_count('100k'), help='historical gift deliveries')
+    parser.add_argument('--gifts', type=int, default=50, help='past drops the history is spread over')
+    parser.add_argument('--invoices', type=parse_count, default=parse_count('10k'))
+    parser.add_argument('--db', help='sqlite file, seeded if empty and kept, default a temporary one')
+    parser.add_argument('--profile', default='default', help='sqlite pragma preset')
+    parser.add_argument('--pool-size', type=int, default=DatabaseConfig().pool_size)
+    parser.add_argument('--no-user-index', dest='user_index', action='store_false',
+                        help='answer counts and eligibility from sql like with database.user_index off')
+    parser.add_argument('--concurrency', type=lambda value: [int(c) for c in value.split(',')], default=[1, 16],
+                        help='comma separated callers sharing the pool, every level runs every method')
+    parser.add_argument('--iterations', type=int, default=500, help='calls per method and concurrency level')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed calls before each measurement')
+    parser.add_argument('--methods', help='comma separated method names, default all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as json instead of a table')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    output = asyncio.run(main(args))
+    if args.json:
+        json.dump(output, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,294 @@
+"""End-to-end drop benchmark.
+
+Runs the real detection -> planning -> reservation -> delivery pipeline against
+a local fake Bot API, an in-process redis and a freshly seeded database:
+
+    python -m benchmarks.drop --users 100k --drop 100:5000@2 --drop 25@3 --latency 10:40 --flood 0.01
+
+and reports detection latency, delivery throughput, p50/p99 time-to-delivery
+and peak memory, as text or --json.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+from functools import partial
+from time import monotonic, perf_counter
+from typing import Any, Optional
+
+import numpy as np
+import structlog
+
+from fakeredis import aioredis as fake_aioredis
+from sqlalchemy import func, select
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from benchmarks.fake_bot_api import Drop, FakeBotAPI
+from benchmarks.seed import parse_count, seed_users
+from src.background import background_gift_updator
+from src.background.gifts import check_new_gifts, deliver_gift
+from src.background.pool import DeliveryPool
+from src.config.reader import ApiConfig, Config, DatabaseConfig, DeliveryConfig
+from src.data.database import Database
+from src.data.database.models import GiftDelivery
+from src.redis import RedisStorage
+from src.utils import PriorityRateLimiter, ThrottlingRequestMiddleware
+
+
+CATALOG = [Drop(5170145012310081615, 15), Drop(5170233102089322756, 25), Drop(5168103777563050263, 50)]
+
+
+def parse_drop(value: str) -> Drop:
+    # PRICE[:SUPPLY][@AT], no supply - unlimited
+    spec, _, at = value.partition('@')
+    price, _, supply = spec.partition(':')
+    return Drop(0, int(price), parse_count(supply) if supply else None, float(at or 1))
+
+
+def percentiles(values: list[float]) -> dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"p50": round(float(p50), 4), "p99": round(float(p99), 4), "max": round(max(values), 4)}
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+async def undelivered(database: Database) -> int:
+    async with database.async_session() as session:
+        return await session.scalar(select(func.count(GiftDelivery.id)).where(GiftDelivery.delivered == False))
+
+
+async def delivered(database: Database) -> int:
+    async with database.async_session() as session:
+        return await session.scalar(select(func.count(GiftDelivery.id)).where(GiftDelivery.delivered == True))
+
+
+async def run_checks(bot: Bot, redis: RedisStorage, logger, interval: float):
+    # the synchronous path: one detection + purchase round per tick, nothing overlaps
+    delivery = bot.config.delivery
+    pool = DeliveryPool(
+        partial(deliver_gift, bot, logger), logger,
+        workers=delivery.workers,
+        queue_size=delivery.queue_size,
+        call_timeout=delivery.call_timeout
+    )
+    pool.start()
+    try:
+        while True:
+            started = monotonic()
+            await check_new_gifts(bot, redis, pool, logger)
+            await asyncio.sleep(max(0.0, interval - (monotonic() - started)))
+    finally:
+        await pool.stop()
+
+
+async def settle(api: FakeBotAPI, database: Database, quiet: float, timeout: float) -> bool:
+    # done once every drop was seen, no delivery is left open and the api went quiet
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        await asyncio.sleep(0.2)
+        if any(drop.seen_at is None for drop in api.drops):
+            continue
+        last = max([drop.seen_at for drop in api.drops] + [d.at for d in api.deliveries[-1:]])
+        if api.now() - last >= quiet and not await undelivered(database):
+            return True
+    return False
+
+
+def report(api: FakeBotAPI, args: argparse.Namespace, **extra) -> dict[str, Any]:
+    drops = {drop.gift_id: drop for drop in api.drops}
+    time_to_delivery = [d.at - drops[d.gift_id].at for d in api.deliveries if d.gift_id in drops]
+
+    per_drop = []
+    for drop in api.drops:
+        times = [d.at for d in api.deliveries if d.gift_id == drop.gift_id]
+        per_drop.append({
+            "gift_id": drop.gift_id,
+            "price": drop.price,
+            "supply": drop.supply,
+            "dropped_at": drop.at,
+            "detection_latency": None if drop.seen_at is None else round(drop.seen_at - drop.at, 4),
+            "delivered": len(times),
+            "first_delivery": round(min(times) - drop.at, 4) if times else None,
+            "last_delivery": round(max(times) - drop.at, 4) if times else None,
+        })
+
+    times = [d.at for d in api.deliveries]
+    span = max(times) - min(times) if len(times) > 1 else 0.0
+    return {
+        "users": args.users,
+        "mode": args.mode,
+        "drops": per_drop,
+        "deliveries": len(api.deliveries),
+        "throughput": round(len(times) / span, 1) if span else None, # gifts per second
+        "time_to_delivery": percentiles(time_to_delivery),
+        "api": {"calls": api.calls, "floods": api.floods, "rejected": api.rejected},
+        **extra
+    }
+
+
+def print_report(result: dict[str, Any]) -> None:
+    print(f'users: {result["users"]}, mode: {result["mode"]}, settled: {result["settled"]}')
+    for drop in result["drops"]:
+        print(
+            f'  gift {drop["gift_id"]} ({drop["price"]}⭐, supply {drop["supply"] or "∞"}): '
+            f'detected +{drop["detection_latency"]}s, {drop["delivered"]} delivered, '
+            f'first +{drop["first_delivery"]}s, last +{drop["last_delivery"]}s'
+        )
+    ttd = result["time_to_delivery"]
+    print(f'deliveries: {result["deliveries"]}, throughput: {result["throughput"]}/s, db delivered: {result["db_delivered"]}')
+    print(f'time to delivery: p50 {ttd["p50"]}s, p99 {ttd["p99"]}s, max {ttd["max"]}s')
+    print(f'api: {result["api"]}')
+    print(f'polls: {result["polls"]}')
+    print(f'seed: {result["seed_seconds"]}s, index: {result["index_seconds"]}s')
+    print(f'memory: peak rss {result["peak_rss_mb"]} MiB, after seed {result["seed_rss_mb"]} MiB, '
+          f'python peak {result["tracemalloc_peak_mb"]} MiB')
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    # bot logs go to stderr, stdout is left for the report
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO if args.verbose else logging.WARNING),
+        logger_factory=structlog.PrintLoggerFactory(sys.stderr)
+    )
+    logger = structlog.get_logger()
+
+    drops = [parse_drop(spec) for spec in args.drop or ['100:1000@1']]
+    for i, drop in enumerate(drops):
+        drop.gift_id = 6000000000000000000 + i
+    low, _, high = args.latency.partition(':')
+    api = FakeBotAPI(
+        drops, CATALOG,
+        latency=(float(low) / 1000, float(high or low) / 1000),
+        flood_rate=args.flood,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+    workdir = tempfile.TemporaryDirectory(prefix='drop-bench-')
+    url = args.database_url or f'sqlite+aiosqlite:///{os.path.join(workdir.name, "bench.sqlite")}'
+    config = Config(
+        version='bench', bot_token='123456:bench', parse_mode='HTML',
+        admin_url='https://t.me/bench', developer='bench', owner=1,
+        vip_poll_interval=1, default_poll_interval=1, vip_price=1000,
+        database=DatabaseConfig(url=url, profile=args.profile),
+        api=ApiConfig(rate=args.api_rate, burst=int(args.api_rate)),
+        delivery=DeliveryConfig(workers=args.workers, chunk_size=args.chunk_size, max_copies=args.max_copies),
+    )
+
+    database = Database(config.database)
+    await database.init_db()
+    started = perf_counter()
+    await seed_users(database, args.users, args.seed)
+    seed_seconds = perf_counter() - started
+    started = perf_counter()
+    await database.load_user_index()
+    index_seconds = perf_counter() - started
+    seed_rss = peak_rss_mb()
+
+    # an in-process stand-in, the pipeline only needs a few set commands
+    redis = RedisStorage('localhost', 6379)
+    redis.redis = fake_aioredis.FakeRedis(decode_responses=True)
+    await redis.connect()
+    for vip in (True, False):
+        # gifts on sale before the run are old news, like in prod
+        await redis.register_gifts((str(drop.gift_id) for drop in CATALOG), vip=vip)
+
+    base = await api.start()
+    bot = Bot(
+        token=config.bot_token,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(base)),
+        default=DefaultBotProperties(parse_mode=config.parse_mode)
+    )
+    limiter = PriorityRateLimiter(config.api.rate, config.api.burst)
+    bot.session.middleware(ThrottlingRequestMiddleware(limiter, logger, config.api.max_retries))
+    bot.logger = logger
+    bot.config = config
+    bot.database = database
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    if args.mode == 'updator':
+        runner = background_gift_updator(bot, redis, logger, args.poll_interval, args.poll_interval)
+    else:
+        runner = run_checks(bot, redis, logger, args.poll_interval)
+    task = asyncio.create_task(runner)
+
+    try:
+        settled = await settle(api, database, args.quiet, args.timeout)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    tracemalloc_peak = None
+    if args.tracemalloc:
+        tracemalloc_peak = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+        tracemalloc.stop()
+
+    result = report(
+        api, args,
+        settled=settled,
+        db_delivered=await delivered(database),
+        polls={scheduler.name: scheduler.stats.report() for scheduler in getattr(bot, 'poll_schedulers', [])},
+        seed_seconds=round(seed_seconds, 2),
+        index_seconds=round(index_seconds, 2),
+        seed_rss_mb=seed_rss,
+        peak_rss_mb=peak_rss_mb(),
+        tracemalloc_peak_mb=tracemalloc_peak
+    )
+
+    await bot.session.close()
+    await api.stop()
+    await redis.close()
+    await database.close()
+    workdir.cleanup()
+    return result
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.drop', description='end-to-end gift drop benchmark')
+    parser.add_argument('--users', type=parse_count, default=parse_count('10k'), help='synthetic users to seed, e.g. 1k, 100k, 1m')
+    parser.add_argument('--drop', action='append', help='PRICE[:SUPPLY][@SECONDS], repeatable, default 100:1000@1')
+    parser.add_argument('--mode', choices=('updator', 'check'), default='updator',
+                        help='background_gift_updator pipeline or one check_new_gifts round per tick')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between polls of each tier')
+    parser.add_argument('--latency', default='0', help='api latency in ms, LOW[:HIGH]')
+    parser.add_argument('--flood', type=float, default=0.0, help='share of sendGift/getAvailableGifts answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds in the 429 answers')
+    parser.add_argument('--api-rate', type=float, default=1000, help='client side api calls per second')
+    parser.add_argument('--workers', type=int, default=DeliveryConfig().workers)
+    parser.add_argument('--chunk-size', type=int, default=DeliveryConfig().chunk_size)
+    parser.add_argument('--max-copies', type=int, default=DeliveryConfig().max_copies)
+    parser.add_argument('--profile', default='sniping', help='sqlite pragma preset')
+    parser.add_argument('--database-url', help='an empty database instead of a temporary sqlite file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quiet', type=float, default=2.0, help='seconds without deliveries that end the run')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace python allocations, slows the run down')
+    parser.add_argument('--json', action='store_true', help='print the result as json')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot logs')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    result = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
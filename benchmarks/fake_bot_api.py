@@ -0,0 +1,171 @@
+import asyncio
+import random
+
+from dataclasses import dataclass, field
+from time import monotonic, time
+from typing import Any, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class Drop:
+    """A gift that shows up in getAvailableGifts `at` seconds after the server started."""
+    gift_id: int
+    price: int
+    supply: Optional[int] = None # None - unlimited
+    at: float = 0.0
+
+    remaining: Optional[int] = None
+    seen_at: Optional[float] = None # first getAvailableGifts answer that contained it
+
+    def __post_init__(self) -> None:
+        self.remaining = self.supply
+
+    def to_api(self) -> dict[str, Any]:
+        gift = {
+            "id": str(self.gift_id),
+            "sticker": {
+                "file_id": f"sticker{self.gift_id}",
+                "file_unique_id": f"sticker{self.gift_id}",
+                "type": "custom_emoji",
+                "width": 512,
+                "height": 512,
+                "is_animated": True,
+                "is_video": False
+            },
+            "star_count": self.price
+        }
+        if self.supply is not None:
+            gift["total_count"] = self.supply
+            gift["remaining_count"] = self.remaining
+        return gift
+
+
+@dataclass
+class Delivery:
+    at: float
+    gift_id: int
+    user_id: int
+
+
+@dataclass
+class FakeBotAPI:
+    """Just enough of the Bot API for the sniper: scripted gift drops, latency and flood waits.
+
+    Every method answers after `latency` (uniform range, seconds). A `flood_rate`
+    share of sendGift / getAvailableGifts calls is answered with 429 and
+    `retry_after`, and a limited gift answers STARGIFT_USAGE_LIMITED once its
+    supply is gone, like the real one.
+    """
+    drops: list[Drop]
+    catalog: list[Drop] = field(default_factory=list) # always on sale
+    latency: tuple[float, float] = (0.0, 0.0)
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    seed: int = 0
+
+    deliveries: list[Delivery] = field(default_factory=list)
+    calls: dict[str, int] = field(default_factory=dict)
+    floods: int = 0
+    rejected: int = 0
+    started: float = field(default_factory=monotonic)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ''
+
+    def now(self) -> float:
+        return monotonic() - self.started
+
+    def drop_time(self, gift_id: int) -> Optional[float]:
+        for drop in self.drops:
+            if drop.gift_id == gift_id:
+                return drop.at
+        return None
+
+    def _live(self) -> list[Drop]:
+        now = self.now()
+        return self.catalog + [drop for drop in self.drops if drop.at <= now]
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        # aiogram picks the exception class by http status, like the real api sends it
+        return web.json_response(body, status=code)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        low, high = self.latency
+        if high:
+            await asyncio.sleep(self._random.uniform(low, high))
+
+        if method in ("sendGift", "getAvailableGifts") and self.flood_rate and self._random.random() < self.flood_rate:
+            self.floods += 1
+            return self._error(
+                429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after
+            )
+
+        handler = getattr(self, f"_{method}", None)
+        if handler is None:
+            return self._error(404, "Not Found: method not found")
+        return handler(params)
+
+    def _getMe(self, params: dict) -> web.Response:
+        return self._ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+
+    def _getAvailableGifts(self, params: dict) -> web.Response:
+        now = self.now()
+        live = self._live()
+        for drop in live:
+            if drop.seen_at is None:
+                drop.seen_at = now
+        return self._ok({"gifts": [drop.to_api() for drop in live]})
+
+    def _sendGift(self, params: dict) -> web.Response:
+        gift_id, user_id = int(params["gift_id"]), int(params["user_id"])
+        drop = next((drop for drop in self._live() if drop.gift_id == gift_id), None)
+        if drop is None:
+            self.rejected += 1
+            return self._error(400, "Bad Request: STARGIFT_INVALID")
+        if drop.remaining is not None:
+            if drop.remaining <= 0:
+                self.rejected += 1
+                return self._error(400, "Bad Request: STARGIFT_USAGE_LIMITED")
+            drop.remaining -= 1
+        self.deliveries.append(Delivery(self.now(), gift_id, user_id))
+        return self._ok(True)
+
+    def _sendMessage(self, params: dict) -> web.Response:
+        return self._ok({
+            "message_id": self.calls["sendMessage"],
+            "date": int(time()),
+            "chat": {"id": int(params["chat_id"]), "type": "channel"},
+            "text": params.get("text", "")
+        })
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+        self.started = monotonic()
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,114 @@
+import random
+
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import func, insert, select
+
+from src.data.database import Database
+from src.data.database.models import GiftDelivery, Invoice, User
+
+
+FIRST_USER_ID = 100_000_000 # looks like a telegram id, far from anything real in a test db
+FIRST_HISTORY_GIFT_ID = 5_000_000_000_000_000_000 # past drops, never in a fake catalog
+
+
+def parse_count(value: str) -> int:
+    # 1000, 10k, 1m, 1_000_000
+    value = value.strip().lower().replace('_', '')
+    for suffix, factor in (('k', 1_000), ('m', 1_000_000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def synthetic_users(
+        count: int,
+        seed: int = 0,
+        vip_share: float = 0.1,
+        broke_share: float = 0.3,
+        max_balance: int = 5000
+    ) -> Iterator[dict]:
+    # a mix close to prod: many empty balances, a few vip, every buying mode
+    rng = random.Random(seed)
+    for i in range(count):
+        mode = rng.choices((0, 1, 2), weights=(70, 20, 10))[0]
+        yield {
+            "id": FIRST_USER_ID + i,
+            "balance": 0 if rng.random() < broke_share else rng.randint(1, max_balance),
+            "vip": rng.random() < vip_share,
+            "buying_mode": mode,
+            "buying_value": rng.randint(10, 100) if mode == 1 else rng.randint(50, 1000) if mode == 2 else 0
+        }
+
+
+async def seed_users(database: Database, count: int, seed: int = 0, chunk_size: int = 50_000, **kwargs) -> int:
+    # plain executemany in chunks, the orm would keep a million objects alive
+    async with database.async_session() as session:
+        existing = await session.scalar(select(func.count(User.id)))
+        if existing:
+            raise RuntimeError(f'benchmark database is not empty: {existing} users')
+
+        chunk = []
+        for row in synthetic_users(count, seed, **kwargs):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                await session.execute(insert(User), chunk)
+                chunk = []
+        if chunk:
+            await session.execute(insert(User), chunk)
+        await session.commit()
+    return count
+
+
+def history_gift_ids(gifts: int) -> list[int]:
+    return [FIRST_HISTORY_GIFT_ID + i for i in range(gifts)]
+
+
+def synthetic_deliveries(count: int, users: int, gifts: int, seed: int = 0, days: int = 90) -> Iterator[dict]:
+    # delivery i belongs to gift i % gifts and user (i // gifts) % users, so every
+    # (gift, user, copy) is unique; almost all of them went through long ago
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    gift_ids = history_gift_ids(gifts)
+    prices = [rng.choice((15, 25, 50, 100, 250, 500)) for _ in gift_ids]
+    for i in range(count):
+        gift = i % gifts
+        created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+        yield {
+            "gift_id": gift_ids[gift],
+            "user_id": FIRST_USER_ID + (i // gifts) % users,
+            "copy": i // (gifts * users),
+            "amount": prices[gift],
+            "delivered": rng.random() < 0.98,
+            "dispatched_at": created_at,
+            "created_at": created_at
+        }
+
+
+async def seed_history(
+        database: Database,
+        deliveries: int,
+        users: int,
+        gifts: int = 50,
+        invoices: int = 0,
+        seed: int = 0,
+        chunk_size: int = 50_000
+    ) -> None:
+    async with database.async_session() as session:
+        chunk = []
+        for row in synthetic_deliveries(deliveries, users, gifts, seed):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                await session.execute(insert(GiftDelivery), chunk)
+                chunk = []
+        if chunk:
+            await session.execute(insert(GiftDelivery), chunk)
+
+        rng = random.Random(seed)
+        for start in range(0, invoices, chunk_size):
+            await session.execute(insert(Invoice), [
+                {"amount": rng.randint(1, 10_000), "message_id": rng.randint(1, 1 << 30), "status": rng.random() < 0.9}
+                for _ in range(start, min(invoices, start + chunk_size))
+            ])
+        await session.commit()
@@ -14,9 +14,11 @@ from aiogram.client.default import DefaultBotProperties
 
 from src.config import ConfigReader
 from src.handlers import get_all_routers
-from src.background import background_gift_updator
-from src.redis import RedisStorage
+from src.background import background_gift_updator, background_index_reconciler, recover_deliveries
+from src.redis import ClusterCoordinator, RedisStorage
 from src.data.database import Database
+from src.metrics import QUEUE_DEPTH, REGISTRY, start_metrics_server
+from src.utils import AccessControl, AccessMiddleware, PriorityRateLimiter, ThrottlingRequestMiddleware, UserMiddleware
 
 
 async def print_info(version: str, bot: Bot, logger: FilteringBoundLogger):
@@ -28,33 +30,90 @@ async def main():
     config = loader_conf._load()
     logger = get_logger()
 
-    redis = RedisStorage(config.redis.host, config.redis.port)
+    redis = RedisStorage.from_config(config.redis)
+    await redis.connect()
 
     bot = Bot(
         token=config.bot_token, 
         default=DefaultBotProperties(parse_mode=config.parse_mode)
     )
+    limiter = PriorityRateLimiter(config.api.rate, config.api.burst)
+    bot.session.middleware(ThrottlingRequestMiddleware(limiter, logger, config.api.max_retries))
     dp = Dispatcher()
 
     bot.logger = logger 
     bot.config = config
     bot.startup_date = datetime.datetime.now().strftime("%d.%m.%Y %H:%M")
 
-    bot.database = Database()
-    await bot.database.init_db()
+    metrics = None
+    if config.metrics.enabled:
+        REGISTRY.enabled = True
+        QUEUE_DEPTH.track(lambda: limiter.queue_depth, 'api_limiter')
+        metrics = await start_metrics_server(REGISTRY, config.metrics.host, config.metrics.port)
+        await logger.ainfo(f'metrics on http://{config.metrics.host}:{config.metrics.port}/metrics')
+
+    bot.database = Database(config.database)
+    migrations = await bot.database.init_db()
+    if migrations:
+        await logger.ainfo(f'applied database migrations', versions=migrations)
+
+    # the index only sees writes made by this process: with balances shared through
+    # postgres or across cluster nodes it would hide other processes' top-ups
+    shared_ledger = config.cluster.enabled or bot.database.backend == 'postgresql'
+    if config.database.user_index and shared_ledger:
+        await logger.ainfo(f'user index disabled, balances are shared with other processes')
+    elif config.database.user_index:
+        await bot.database.load_user_index()
+        await logger.ainfo(f'user index loaded', users=len(bot.database.user_index))
+        asyncio.create_task(background_index_reconciler(
+            bot, logger, config.database.user_index_reconcile_interval
+        ))
+
+    # finish or refund purchases a previous run left half done; clustered nodes
+    # only take over jobs old enough that their owner must be gone
+    await recover_deliveries(
+        bot, logger, config.delivery.recovery_grace if config.cluster.enabled else 0
+    )
 
     await print_info(config.version, bot, logger)
 
+    # one in-memory copy of the whitelist, checked before any handler runs
+    access = AccessMiddleware(AccessControl(config.users_file, config.owner).load())
+    dp.message.outer_middleware(access)
+    dp.callback_query.outer_middleware(access)
+    # inner: only updates that reach a handler load the user row
+    dp.message.middleware(UserMiddleware())
+    dp.callback_query.middleware(UserMiddleware())
+
     for router, rname in get_all_routers():
         dp.include_router(router)
         await logger.adebug(f'load router', router=rname)
 
-    asyncio.create_task(background_gift_updator(
+    cluster = None
+    if config.cluster.enabled:
+        cluster = ClusterCoordinator(redis.redis, config.cluster, logger)
+        asyncio.create_task(cluster.run())
+        await logger.ainfo(f'cluster mode', node=cluster.node_id, handle_updates=config.cluster.handle_updates)
+
+    updator = asyncio.create_task(background_gift_updator(
         bot, redis, logger, 
-        config.vip_poll_interval, config.default_poll_interval
+        config.vip_poll_interval, config.default_poll_interval,
+        cluster
     ))
 
-    await dp.start_polling(bot)
+    try:
+        if config.cluster.enabled and not config.cluster.handle_updates:
+            # purchase-only node, another process answers users
+            await updator
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if cluster is not None:
+            await cluster.leave()
+        await bot.database.close()
+        await redis.close()
+        if metrics is not None:
+            await metrics.cleanup()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
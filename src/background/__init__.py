@@ -1,5 +1,7 @@
 from src.background.gifts import background_gift_updator
+from src.background.index import background_index_reconciler
+from src.background.recovery import recover_deliveries
 
 __all__ = [
-    "background_gift_updator"
+    "background_gift_updator", "background_index_reconciler", "recover_deliveries"
 ]
\ No newline at end of file
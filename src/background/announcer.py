@@ -0,0 +1,68 @@
+import asyncio
+
+from time import monotonic
+
+from structlog.typing import FilteringBoundLogger
+
+from aiogram import Bot
+
+from src.background.catalog import UNLIMITED_SUPPLY
+from src.utils import Priority, api_priority
+
+
+class Announcer:
+    """Posts new gifts to the configured channels from its own task, never on the purchase path."""
+
+    def __init__(
+            self,
+            bot: Bot,
+            logger: FilteringBoundLogger,
+            channels: list[int],
+            interval: float = 1.0,
+            queue_size: int = 100
+        ) -> None:
+        self.bot = bot
+        self.logger = logger
+        self.channels = channels
+        self.interval = interval
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def announce(self, gift_data: dict) -> None:
+        if not self.channels:
+            return
+        try:
+            self.queue.put_nowait(gift_data)
+        except asyncio.QueueFull:
+            # a post is not worth slowing detection for
+            self.dropped += 1
+
+    @staticmethod
+    def render(gift_data: dict) -> str:
+        supply = gift_data["count"] if gift_data["count"] != UNLIMITED_SUPPLY else 'Infinity'
+        return (
+            f"<b>❗️ NEW GIFT OUT!</b>\n"
+            f"🎁 — Price: <b>{gift_data['amount']:.2f} ⭐️</b>\n"
+            f"Supply: <b>{supply}</b>\n\n"
+            f'<b><a href="https://t.me/giftomaticrobot">💎 Моментальная автоскупка подарков — Giftomatic</a></b>'
+        )
+
+    async def run(self) -> None:
+        while True:
+            gift_data = await self.queue.get()
+            text = self.render(gift_data)
+            for channel_id in self.channels:
+                started = monotonic()
+                try:
+                    # behind purchases and handler replies in the api limiter
+                    with api_priority(Priority.COSMETIC):
+                        await self.bot.send_message(
+                            chat_id=channel_id,
+                            text=text,
+                            parse_mode="HTML",
+                            disable_web_page_preview=True
+                        )
+                except Exception as e:
+                    await self.logger.aerror(f'Failed to announce gift {gift_data["id"]} in {channel_id}: {e}')
+                # channels allow about one post per second
+                await asyncio.sleep(max(0.0, self.interval - (monotonic() - started)))
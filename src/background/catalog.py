@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from aiogram.types import Gift
+
+
+# stands in for the supply of gifts without total_count
+UNLIMITED_SUPPLY = 1_000_000
+
+@dataclass
+class CatalogDiff:
+    fingerprint: int
+    added: list[Gift] = field(default_factory=list)
+    supply_changed: dict[int, Optional[int]] = field(default_factory=dict) # gift id -> remaining
+    removed: list[int] = field(default_factory=list)
+
+
+class CatalogTracker:
+    """Remembers the last seen catalog so unchanged polls cost one hash."""
+
+    def __init__(self) -> None:
+        self.fingerprint: Optional[int] = None
+        self.supply: dict[int, Optional[int]] = {}
+
+    @staticmethod
+    def fingerprint_of(gifts: Sequence[Gift]) -> int:
+        return hash(tuple((gift.id, gift.remaining_count) for gift in gifts))
+
+    def compare(self, gifts: Sequence[Gift]) -> Optional[CatalogDiff]:
+        # None means nothing changed since the last accepted poll
+        fingerprint = self.fingerprint_of(gifts)
+        if fingerprint == self.fingerprint:
+            return None
+
+        diff = CatalogDiff(fingerprint)
+        seen = set()
+        for gift in gifts:
+            gift_id = int(gift.id)
+            seen.add(gift_id)
+            if gift_id not in self.supply:
+                diff.added.append(gift)
+            elif self.supply[gift_id] != gift.remaining_count:
+                diff.supply_changed[gift_id] = gift.remaining_count
+        diff.removed = [gift_id for gift_id in self.supply if gift_id not in seen]
+        return diff
+
+    def accept(self, diff: CatalogDiff) -> None:
+        # only called once the diff was fully processed, so a failed poll is retried next time
+        self.fingerprint = diff.fingerprint
+        for gift in diff.added:
+            self.supply[int(gift.id)] = gift.remaining_count
+        self.supply.update(diff.supply_changed)
+        for gift_id in diff.removed:
+            self.supply.pop(gift_id, None)
@@ -1,77 +1,278 @@
 import asyncio
-from math import gcd
+from collections import deque
+from functools import partial
+from time import monotonic, perf_counter, time
+from typing import Awaitable, Callable, Optional
 
 from structlog.typing import FilteringBoundLogger
 
 from aiogram import Bot 
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 
-from src.redis import RedisStorage
+from src.redis import ClusterCoordinator, RedisStorage
+from src.utils import RequestCancelled, request_gate
+from src.metrics import (
+    DETECTION_TO_LAST_DELIVERY, POLL_SECONDS, QUEUE_DEPTH, SEND_GIFT_ERRORS, SEND_GIFT_SECONDS
+)
+from src.background.announcer import Announcer
+from src.background.catalog import UNLIMITED_SUPPLY, CatalogTracker
+from src.background.planner import gift_rows, in_plan_order, iter_batches, plan_purchases
+from src.background.pool import DeliveryJob, DeliveryPool, GiftRun
+from src.background.scheduler import PollScheduler
+from src.background.supervisor import supervise
+from src.background.tokens import PollerPool
 
-async def process_user_batch(bot: Bot, users: list, gift_data: dict, logger: FilteringBoundLogger):
-    for user in users:
+# error texts telegram answers send_gift with once a limited gift is gone
+SOLD_OUT_ERRORS = ('STARGIFT_USAGE_LIMITED', 'STARGIFT_SOLD_OUT', 'SOLD_OUT')
+
+
+def is_sold_out_error(error: TelegramBadRequest) -> bool:
+    message = error.message.upper()
+    return any(marker in message for marker in SOLD_OUT_ERRORS)
+
+
+async def deliver_gift(bot: Bot, logger: FilteringBoundLogger, job: DeliveryJob) -> bool:
+    gift_data = job.run.gift_data
+    dispatched = False
+
+    async def dispatch() -> bool:
+        # stamped only once the limiter let the call through, a job that times out
+        # while still queued is refunded instead of assumed delivered
+        nonlocal dispatched
+        if not dispatched:
+            dispatched = await bot.database.mark_dispatched(job.delivery_id)
+        return dispatched
+
+    token = request_gate.set(dispatch)
+    try:
+        started = perf_counter()
         try:
-            while not await bot.database.get_gift_delivery(int(gift_data["id"]), user.id):
-                delivery = await bot.database.create_gift_delivery(gift_data["id"], user.id)
-                if await bot.database.user_buy_gift(gift_data["amount"], user.id):
-                    await bot.send_gift(
-                        user.id, str(gift_data["id"])
-                    )
-                    await logger.ainfo(f'gift {gift_data["id"]} delivered to user {user.id}')
-                    await bot.database.mark_gift_delivered(delivery.id)
+            await bot.send_gift(
+                job.user_id, str(gift_data["id"])
+            )
+        except RequestCancelled:
+            # released or delivered by someone else meanwhile
+            return False
         except Exception as e:
-            await logger.aerror(f'Failed to deliver gift {gift_data["id"]} to user {user.id}: {e}')
-            continue
+            SEND_GIFT_SECONDS.observe(perf_counter() - started, 'error')
+            SEND_GIFT_ERRORS.inc(type(e).__name__)
+            if isinstance(e, (TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter)):
+                # telegram rejected the call, nothing was sent - refund
+                await bot.database.release_purchase(job.delivery_id)
+                if isinstance(e, TelegramBadRequest) and is_sold_out_error(e) and not job.run.sold_out:
+                    job.run.sold_out = True
+                    await logger.awarning(f'gift {gift_data["id"]} sold out, cancelling the remaining jobs')
+            else:
+                # network errors, 5xx, a failed stamp: settled with the run like a timeout
+                job.run.unknown_ids.append(job.delivery_id)
+            raise
+        SEND_GIFT_SECONDS.observe(perf_counter() - started, 'ok')
 
+        job.run.record_delivery(job.delivery_id)
+        await logger.ainfo(f'gift {gift_data["id"]} delivered to user {job.user_id}')
+        return True
+    except Exception as e:
+        await logger.aerror(f'Failed to deliver gift {gift_data["id"]} to user {job.user_id}: {e}')
+        return False
+    finally:
+        request_gate.reset(token)
 
-async def check_new_gifts(bot: Bot, redis: RedisStorage, logger: FilteringBoundLogger, vip_only: bool = False) -> bool:
-    try:
+
+async def poll_new_gifts(
+        bot: Bot,
+        redis: RedisStorage,
+        logger: FilteringBoundLogger,
+        vip_only: bool = False,
+        catalog: Optional[CatalogTracker] = None,
+        pollers: Optional[PollerPool] = None
+    ) -> list[dict]:
+    # auxiliary tokens only detect, announcements and purchases stay on the main bot
+    started = perf_counter()
+    if pollers is not None:
+        result = await pollers.get_available_gifts()
+    else:
         result = await bot.get_available_gifts()
-        validate_result = []
-
-        for item in result.gifts:
-            gift_id = int(item.id)
-            if redis.add_gift(gift_id, vip=vip_only):
-                await logger.ainfo(f'new gift registered: {gift_id}')
-                validate_result.append({"id": gift_id, "count": item.total_count if item.total_count else 1_000_000, "amount": item.star_count})
-
-                channel_id = -1002365357206
-                message_text = (
-                    f"<b>❗️ NEW GIFT OUT!</b>\n"
-                    f"🎁 — Price: <b>{item.star_count:.2f} ⭐️</b>\n"
-                    # f"Supply: <b>{item.total_count if item.total_count else '∞'}</b>\n\n"
-                    f"Supply: <b>{item.total_count if item.total_count else 'Infinity'}</b>\n\n"
-                    f'<b><a href="https://t.me/giftomaticrobot">💎 Моментальная автоскупка подарков — Giftomatic</a></b>'
-                )
-
-                await bot.send_message(
-                    chat_id=channel_id,
-                    text=message_text,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True
-                )
-
-        if validate_result:
-            sorted_gifts = sorted(validate_result, key=lambda x: (x["count"], -x["amount"]))
-            all_users = await bot.database.get_user_updator(vip_only)
+    detected = time()
+    POLL_SECONDS.observe(perf_counter() - started, 'vip' if vip_only else 'default')
+    validate_result = []
 
-            for gift_data in sorted_gifts:
-                tasks = []
+    candidates = result.gifts
+    if catalog is not None:
+        diff = catalog.compare(result.gifts)
+        if diff is None:
+            # steady state: same ids and supply as last time, no redis round trip
+            return []
+        if diff.supply_changed:
+            await logger.adebug(f'gift supply changed', supply=diff.supply_changed)
+        candidates = diff.added
 
-                for i in range(0, len(all_users), bot.config.bach_size):
-                    user_batch = all_users[i:i + bot.config.bach_size]
-                    task = asyncio.create_task(
-                        process_user_batch(bot, user_batch, gift_data, logger)
-                    )
-                    tasks.append(task)
+    new_gift_ids = set(await redis.register_gifts((item.id for item in candidates), vip=vip_only))
+    if catalog is not None:
+        catalog.accept(diff)
 
-                if tasks:
-                    await asyncio.gather(*tasks)
+    for item in candidates:
+        gift_id = int(item.id)
+        if gift_id in new_gift_ids:
+            await logger.ainfo(f'new gift registered: {gift_id}')
+            validate_result.append({
+                "id": gift_id,
+                "count": item.total_count if item.total_count else UNLIMITED_SUPPLY,
+                "amount": item.star_count,
+                # what is actually left at detection time, None for unlimited gifts
+                "supply": item.remaining_count if item.total_count else None,
+                "detected": detected
+            })
 
-        return True
+    return sorted(validate_result, key=lambda x: (x["count"], -x["amount"]))
+
+
+async def purchase_gifts(
+        bot: Bot,
+        pool: DeliveryPool,
+        logger: FilteringBoundLogger,
+        sorted_gifts: list[dict],
+        vip_only: bool = False,
+        shard: Optional[Callable[[int], bool]] = None
+    ) -> list[asyncio.Task]:
+    # reservations run gift by gift in priority order, so a user's stars go to the
+    # scarcest gift first; deliveries of all gifts then overlap inside the pool.
+    # returns one task per gift that finishes once its deliveries are settled
+    delivery = bot.config.delivery
+    try:
+        # who buys how many copies of what, decided once for the whole drop
+        started = monotonic()
+        snapshot = await bot.database.get_user_snapshot(min(gift["amount"] for gift in sorted_gifts))
+        plan = plan_purchases(snapshot, sorted_gifts, vip_only, delivery.max_copies)
+        await logger.ainfo(
+            f'purchase plan ready', gifts=len(sorted_gifts), buyers=len(plan),
+            copies=int(plan["copies"].sum()), took=round(monotonic() - started, 4)
+        )
+    except Exception as e:
+        await logger.aerror(f'Error planning purchases: {e}')
+        return []
+
+    finishing = []
+    for index, gift_data in enumerate(sorted_gifts):
+        try:
+            run = GiftRun(gift_data)
+
+            # each chunk is debited in one statement per copy count and handed to the pool
+            # right away, the debit re-checks balances so a stale snapshot never overdraws
+            for users, groups in iter_batches(gift_rows(plan, index), delivery.chunk_size):
+                if run.sold_out:
+                    # no point debiting anyone else
+                    break
+                reservations = []
+                for copies, user_ids in groups:
+                    if shard is not None:
+                        # clustered: every node plans the whole drop and buys for its own users
+                        user_ids = [user_id for user_id in user_ids if shard(user_id)]
+                        if not user_ids:
+                            continue
+                    reservations.extend(await bot.database.reserve_gift_batch(
+                        gift_data["id"], gift_data["amount"], only_vip=vip_only, user_ids=user_ids, copies=copies
+                    ))
+                for delivery_id, user_id in in_plan_order(users, reservations):
+                    await pool.submit(DeliveryJob(run, delivery_id, user_id))
+            run.seal()
+            await logger.ainfo(f'gift {gift_data["id"]} reserved {run.total} copies')
+            finishing.append(asyncio.create_task(finish_purchase(bot, logger, run)))
+        except Exception as e:
+            await logger.aerror(f'Error purchasing gift {gift_data["id"]}: {e}')
+    return finishing
+
+
+async def finish_purchase(bot: Bot, logger: FilteringBoundLogger, run: GiftRun):
+    await run.wait()
+    if run.last_delivery_at is not None and "detected" in run.gift_data:
+        DETECTION_TO_LAST_DELIVERY.observe(run.last_delivery_at - run.gift_data["detected"])
+    try:
+        # jobs cancelled after the sell-out were debited but never sent
+        await bot.database.release_deliveries(run.cancelled_ids)
+    except Exception as e:
+        await logger.aerror(f'Failed to release {run.cancelled} cancelled deliveries of gift {run.gift_data["id"]}: {e}')
+    # sends cut off by the call timeout or failed without a clear answer,
+    # the stars must not stay held until a restart
+    unanswered = run.timed_out_ids + run.unknown_ids
+    try:
+        released, committed = await bot.database.resolve_unanswered(unanswered)
+        if released or committed:
+            await logger.awarning(
+                f'resolved unanswered deliveries of gift {run.gift_data["id"]}', refunded=released, assumed_delivered=committed
+            )
+    except Exception as e:
+        await logger.aerror(f'Failed to resolve {len(unanswered)} unanswered deliveries of gift {run.gift_data["id"]}: {e}')
+    try:
+        await bot.database.commit_deliveries(run.delivered_ids)
+    except Exception as e:
+        await logger.aerror(f'Failed to mark gift {run.gift_data["id"]} delivered for {run.delivered} users: {e}')
+    await logger.ainfo(f'gift {run.gift_data["id"]} purchase stage finished', **run.report())
+
+
+async def check_new_gifts(
+        bot: Bot,
+        redis: RedisStorage,
+        pool: DeliveryPool,
+        logger: FilteringBoundLogger,
+        vip_only: bool = False,
+        announcer: Optional[Announcer] = None
+    ) -> bool:
+    # one synchronous detection + purchase round
+    try:
+        sorted_gifts = await poll_new_gifts(bot, redis, logger, vip_only)
     except Exception as e:
         await logger.aerror(f"Error checking gifts: {e}")
         return False
 
+    if sorted_gifts:
+        purchase = asyncio.create_task(purchase_gifts(bot, pool, logger, sorted_gifts, vip_only))
+        if announcer is not None:
+            for gift_data in sorted_gifts:
+                announcer.announce(gift_data)
+        await asyncio.gather(*await purchase)
+    return True
+
+
+async def purchase_worker(
+        bot: Bot,
+        pool: DeliveryPool,
+        logger: FilteringBoundLogger,
+        purchases: asyncio.Queue,
+        cluster: Optional[ClusterCoordinator] = None,
+        finishing: Optional[set[asyncio.Task]] = None
+    ):
+    shard = cluster.owns if cluster is not None else None
+    # owned by the caller so a restarted worker keeps the running finishers referenced
+    finishing = set() if finishing is None else finishing
+    while True:
+        sorted_gifts, vip_only = await purchases.get()
+        try:
+            # only the reservations are awaited, the next drop starts while this one delivers
+            for task in await purchase_gifts(bot, pool, logger, sorted_gifts, vip_only, shard):
+                finishing.add(task)
+                task.add_done_callback(finishing.discard)
+        finally:
+            purchases.task_done()
+
+
+def cluster_event_listener(cluster: ClusterCoordinator, purchases: asyncio.Queue) -> Callable[[], Awaitable[None]]:
+    recent = deque()
+
+    async def on_event(sorted_gifts: list[dict], vip_only: bool, published: float):
+        recent.append((published, sorted_gifts, vip_only))
+        purchases.put_nowait((sorted_gifts, vip_only))
+
+    async def on_rebalance():
+        # users that just moved to this node may have been skipped by their old owner,
+        # re-run recent drops - already claimed deliveries are never bought twice
+        while recent and recent[0][0] < time() - cluster.config.replay_window:
+            recent.popleft()
+        for _, sorted_gifts, vip_only in recent:
+            purchases.put_nowait((sorted_gifts, vip_only))
+
+    # registered once, the returned stage may be restarted many times
+    cluster.on_rebalance(on_rebalance)
+    return partial(cluster.listen, on_event)
 
 
 async def background_gift_updator(
@@ -79,25 +280,86 @@ async def background_gift_updator(
         redis: RedisStorage, 
         logger: FilteringBoundLogger, 
         vip_poll_interval: int,
-        default_poll_interval: int
+        default_poll_interval: int,
+        cluster: Optional[ClusterCoordinator] = None
     ):
-    
-    base_interval = gcd(vip_poll_interval, default_poll_interval)
-    cycles_until_default = default_poll_interval // base_interval
-    cycles_until_vip = vip_poll_interval // base_interval
-    current_cycle = 0
-    
-    await logger.ainfo(f'base interval: {base_interval}, default: {default_poll_interval}, vip: {vip_poll_interval}')
+    await logger.ainfo(f'poll intervals, default: {default_poll_interval}, vip: {vip_poll_interval}')
 
-    while True:
-        is_vip_cycle = current_cycle % cycles_until_vip == 0
-        is_default_cycle = current_cycle % cycles_until_default == 0
-    
-        if is_default_cycle:
-            await check_new_gifts(bot, redis, logger, vip_only=False)
-
-        elif is_vip_cycle:
-            await check_new_gifts(bot, redis, logger, vip_only=True)
-            
-        current_cycle += 1
-        await asyncio.sleep(base_interval)
\ No newline at end of file
+    delivery = bot.config.delivery
+    pool = DeliveryPool(
+        partial(deliver_gift, bot, logger), logger,
+        workers=delivery.workers,
+        queue_size=delivery.queue_size,
+        call_timeout=delivery.call_timeout
+    )
+    pool.start()
+
+    # detection never waits for purchases: polls only enqueue what they found
+    purchases = asyncio.Queue()
+    pollers = PollerPool.from_tokens(
+        bot, bot.config.poll_tokens, logger,
+        max_consecutive_errors=bot.config.poll_token_max_errors
+    )
+    if bot.config.poll_tokens:
+        await logger.ainfo(f'polling with {len(pollers.tokens)} tokens')
+
+    announce = bot.config.announce
+    announcer = Announcer(
+        bot, logger, announce.channels,
+        interval=announce.interval,
+        queue_size=announce.queue_size
+    )
+
+    def tier_poll(vip_only: bool):
+        catalog = CatalogTracker()
+
+        async def poll():
+            if cluster is not None and not cluster.is_leader:
+                # exactly one node polls, the others wait for its events
+                return
+            sorted_gifts = await poll_new_gifts(bot, redis, logger, vip_only, catalog, pollers)
+            if not sorted_gifts:
+                return
+            if cluster is not None:
+                await cluster.publish(sorted_gifts, vip_only)
+            else:
+                purchases.put_nowait((sorted_gifts, vip_only))
+            # purchases are already on their way, the channel post can wait
+            for gift_data in sorted_gifts:
+                announcer.announce(gift_data)
+        return poll
+
+    schedulers = [
+        PollScheduler(
+            name, interval, tier_poll(vip_only), logger,
+            jitter=bot.config.poll_jitter,
+            max_backoff=bot.config.poll_max_backoff,
+            lanes=pollers.size
+        )
+        for name, interval, vip_only in (
+            ('vip', vip_poll_interval, True),
+            ('default', default_poll_interval, False)
+        )
+    ]
+    bot.poll_schedulers = schedulers
+    bot.pollers = pollers
+
+    QUEUE_DEPTH.track(pool.queue.qsize, 'delivery')
+    QUEUE_DEPTH.track(purchases.qsize, 'purchases')
+    QUEUE_DEPTH.track(announcer.queue.qsize, 'announce')
+
+    # every stage restarts on its own after a crash, a dead purchase worker never
+    # leaves detection polling for nothing
+    finishing = set()
+    stages = {
+        'purchases': partial(purchase_worker, bot, pool, logger, purchases, cluster, finishing),
+        'announcer': announcer.run,
+        **{f'{scheduler.name} poll': scheduler.run for scheduler in schedulers}
+    }
+    if cluster is not None:
+        stages['cluster events'] = cluster_event_listener(cluster, purchases)
+
+    try:
+        await asyncio.gather(*(supervise(name, stage, logger) for name, stage in stages.items()))
+    finally:
+        await pollers.close()
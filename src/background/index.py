@@ -0,0 +1,18 @@
+import asyncio
+
+from structlog.typing import FilteringBoundLogger
+
+from aiogram import Bot
+
+
+async def background_index_reconciler(bot: Bot, logger: FilteringBoundLogger, interval: int):
+    # the database is the source of truth, reload the in-memory index from it
+    # so any missed incremental update is fixed within one interval
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            drift = await bot.database.load_user_index()
+            if drift:
+                await logger.awarning(f'user index drifted from database, fixed {drift} entries')
+        except Exception as e:
+            await logger.aerror(f'Error reconciling user index: {e}')
@@ -0,0 +1,92 @@
+from typing import Iterable, Iterator, Sequence
+
+import numpy as np
+
+
+# User.buying_mode
+MODE_ALL_IN = 0 # the whole balance
+MODE_PERCENT = 1 # buying_value percent of the balance
+MODE_LIMIT = 2 # at most buying_value stars
+
+# one row per (gift, user) that buys anything, grouped by gift index
+PLAN_DTYPE = np.dtype([("gift", np.int32), ("user", np.int64), ("copies", np.int32)])
+
+
+def plan_purchases(
+        snapshot: tuple[Sequence[int], ...],
+        gifts: Sequence[dict],
+        only_vip: bool = False,
+        max_copies: int = 1
+    ) -> np.ndarray:
+    """How many copies of which gift every user gets in one drop, in one pass over all users.
+
+    `snapshot` holds the (ids, balances, vip, modes, values) columns sorted by
+    (balance, id) like UserIndex, and `gifts` comes in priority order: a user's
+    budget goes to the first gifts first, and the supply of a gift goes to vip
+    users first, then to the richest.
+    """
+    ids, balances, vip, modes, values = (np.asarray(column, dtype=np.int64) for column in snapshot)
+    if only_vip:
+        keep = vip != 0
+        ids, balances, vip, modes, values = ids[keep], balances[keep], vip[keep], modes[keep], values[keep]
+
+    balances = np.maximum(balances, 0)
+    budget = np.select(
+        [modes == MODE_PERCENT, modes == MODE_LIMIT],
+        [balances * np.clip(values, 0, 100) // 100, np.minimum(balances, np.maximum(values, 0))],
+        default=balances
+    )
+
+    # same order as UserIndex.eligible: vip first, then the richest. the input is
+    # already sorted, a stable sort on the vip flag alone is enough
+    order = np.arange(len(ids) - 1, -1, -1)
+    order = order[np.argsort(-vip[order], kind='stable')]
+    ids, budget = ids[order], budget[order]
+
+    parts = []
+    for index, gift_data in enumerate(gifts):
+        price = int(gift_data["amount"])
+        if price <= 0:
+            continue
+        copies = budget // price
+        if max_copies:
+            np.minimum(copies, max_copies, out=copies)
+
+        supply = gift_data.get("supply")
+        if supply is not None:
+            # the user where the running total crosses the supply gets what is left, later ones nothing
+            taken = np.cumsum(copies)
+            copies = np.clip(supply - (taken - copies), 0, copies)
+
+        budget -= copies * price
+        buyers = np.flatnonzero(copies)
+        part = np.empty(len(buyers), dtype=PLAN_DTYPE)
+        part["gift"] = index
+        part["user"] = ids[buyers]
+        part["copies"] = copies[buyers]
+        parts.append(part)
+
+    return np.concatenate(parts) if parts else np.empty(0, dtype=PLAN_DTYPE)
+
+
+def gift_rows(plan: np.ndarray, index: int) -> np.ndarray:
+    start, stop = np.searchsorted(plan["gift"], [index, index + 1])
+    return plan[start:stop]
+
+
+def iter_batches(rows: np.ndarray, chunk_size: int) -> Iterator[tuple[list[int], list[tuple[int, list[int]]]]]:
+    # chunks in purchase order as (users, [(copies, users), ...]): one debit statement
+    # per distinct copy count in the chunk, the chunk's users keep the plan order
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        counts, groups = np.unique(chunk["copies"], return_inverse=True)
+        yield chunk["user"].tolist(), [
+            (int(copies), chunk["user"][groups == group].tolist()) for group, copies in enumerate(counts)
+        ]
+
+
+def in_plan_order(users: list[int], reservations: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    # (delivery_id, user_id) rows come back in user id order per statement,
+    # hand them to the pool in the order the users were planned instead
+    position = {user_id: i for i, user_id in enumerate(users)}
+    return sorted(reservations, key=lambda row: (position[row[1]], row[0]))
@@ -0,0 +1,209 @@
+import asyncio
+
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import count
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Optional
+
+from structlog.typing import FilteringBoundLogger
+
+from src.metrics import DETECTION_TO_FIRST_DELIVERY, SEND_GIFT_ERRORS
+
+
+@dataclass
+class GiftRun:
+    """Progress of one gift's purchase stage inside the pool."""
+    gift_data: dict
+    total: int = 0
+    delivered: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    cancelled: int = 0 # jobs dropped without an api call once the gift sold out
+    blocked: float = 0.0 # seconds submit() waited on a full queue
+    max_queue_depth: int = 0
+    delivered_ids: list[int] = field(default_factory=list)
+    cancelled_ids: list[int] = field(default_factory=list)
+    timed_out_ids: list[int] = field(default_factory=list) # outcome unknown, resolved with the run
+    unknown_ids: list[int] = field(default_factory=list) # failed sends telegram may have performed, same
+    supply: Optional[int] = None # copies left on sale, None - unlimited
+    sold_out: bool = False
+    last_delivery_at: Optional[float] = None # wall clock, detection time may come from another node
+    started: float = field(default_factory=monotonic)
+    finished: Optional[float] = None
+
+    _sealed: bool = False
+    _done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def __post_init__(self) -> None:
+        if self.supply is None:
+            self.supply = self.gift_data.get("supply")
+        self.sold_out = self.supply is not None and self.supply <= 0
+
+    @property
+    def priority(self) -> tuple[int, int]:
+        # scarcest first, then the most expensive - same order as the drop itself
+        return self.gift_data["count"], -self.gift_data["amount"]
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.delivered - self.failed - self.timed_out - self.cancelled
+
+    def record_delivery(self, delivery_id: int) -> None:
+        self.delivered_ids.append(delivery_id)
+        self.last_delivery_at = time()
+        if len(self.delivered_ids) == 1 and "detected" in self.gift_data:
+            DETECTION_TO_FIRST_DELIVERY.observe(self.last_delivery_at - self.gift_data["detected"])
+        if self.supply is not None:
+            self.supply -= 1
+            if self.supply <= 0:
+                self.sold_out = True
+
+    def cancel(self, delivery_id: int) -> None:
+        self.cancelled += 1
+        self.cancelled_ids.append(delivery_id)
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or monotonic()) - self.started
+
+    def seal(self) -> None:
+        # no more jobs will be submitted for this gift
+        self._sealed = True
+        self.check_done()
+
+    def check_done(self) -> None:
+        if self._sealed and self.pending == 0 and not self._done.is_set():
+            self.finished = monotonic()
+            self._done.set()
+
+    async def wait(self) -> "GiftRun":
+        await self._done.wait()
+        return self
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "gift": self.gift_data["id"],
+            "total": self.total,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "unknown": len(self.unknown_ids),
+            "cancelled": self.cancelled,
+            "sold_out": self.sold_out,
+            "duration": round(self.duration, 3),
+            "blocked": round(self.blocked, 3),
+            "max_queue_depth": self.max_queue_depth
+        }
+
+
+@dataclass
+class DeliveryJob:
+    run: GiftRun
+    delivery_id: int
+    user_id: int
+
+
+class DeliveryPool:
+    """Fixed number of workers pulling purchase jobs from one bounded priority queue.
+
+    Jobs of several gifts share the queue, the scarcest gift is always served
+    first. Jobs of one user never run concurrently, they follow each other in
+    priority order.
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[DeliveryJob], Awaitable[bool]],
+            logger: FilteringBoundLogger,
+            workers: int = 16,
+            queue_size: int = 1000,
+            call_timeout: float = 15.0
+        ) -> None:
+        self.handler = handler
+        self.logger = logger
+        self.workers = workers
+        self.call_timeout = call_timeout
+        self.queue: asyncio.PriorityQueue[tuple[tuple[int, int], int, DeliveryJob]] = asyncio.PriorityQueue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._sequence = count()
+        self._active: set[int] = set()
+        self._deferred: dict[int, deque[DeliveryJob]] = {}
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'delivery-worker-{i}')
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: DeliveryJob) -> None:
+        job.run.total += 1
+        item = (job.run.priority, next(self._sequence), job)
+        if self.queue.full():
+            # backpressure: the producer waits for a free slot
+            started = monotonic()
+            await self.queue.put(item)
+            job.run.blocked += monotonic() - started
+        else:
+            self.queue.put_nowait(item)
+        job.run.max_queue_depth = max(job.run.max_queue_depth, self.queue.qsize())
+
+    async def _worker(self) -> None:
+        while True:
+            *_, job = await self.queue.get()
+            try:
+                user_id = job.user_id
+                if user_id in self._active:
+                    # the worker busy with this user picks it up next
+                    self._deferred.setdefault(user_id, deque()).append(job)
+                    continue
+
+                self._active.add(user_id)
+                try:
+                    while job is not None:
+                        await self._run(job)
+                        job = self._next_for(user_id)
+                finally:
+                    self._active.discard(user_id)
+            finally:
+                self.queue.task_done()
+
+    def _next_for(self, user_id: int) -> Optional[DeliveryJob]:
+        deferred = self._deferred.get(user_id)
+        if not deferred:
+            self._deferred.pop(user_id, None)
+            return None
+        return deferred.popleft()
+
+    async def _run(self, job: DeliveryJob) -> None:
+        if job.run.sold_out:
+            # nothing left to buy, the reservation is released in bulk with the others
+            job.run.cancel(job.delivery_id)
+            job.run.check_done()
+            return
+        try:
+            if await asyncio.wait_for(self.handler(job), self.call_timeout):
+                job.run.delivered += 1
+            else:
+                job.run.failed += 1
+        except asyncio.TimeoutError:
+            job.run.timed_out += 1
+            job.run.timed_out_ids.append(job.delivery_id)
+            SEND_GIFT_ERRORS.inc('timeout')
+            await self.logger.aerror(
+                f'delivery of gift {job.run.gift_data["id"]} to user {job.user_id} '
+                f'timed out after {self.call_timeout}s'
+            )
+        except Exception as e:
+            job.run.failed += 1
+            await self.logger.aerror(f'delivery worker failed on user {job.user_id}: {e}')
+        finally:
+            job.run.check_done()
@@ -0,0 +1,82 @@
+from collections import defaultdict
+from functools import partial
+from typing import Any
+
+from structlog.typing import FilteringBoundLogger
+
+from aiogram import Bot
+
+from src.background.catalog import UNLIMITED_SUPPLY
+from src.background.gifts import deliver_gift, finish_purchase
+from src.background.pool import DeliveryJob, DeliveryPool, GiftRun
+
+
+async def recover_deliveries(bot: Bot, logger: FilteringBoundLogger, older_than: float = 0.0) -> dict[str, Any]:
+    # gift_deliveries is the job log: every reservation that was never acknowledged
+    # is either finished or refunded here, before new drops are polled
+    database = bot.database
+    pending = await database.get_pending_deliveries(older_than)
+    report = {"pending": len(pending), "assumed_delivered": 0, "resent": 0, "refunded": 0}
+    if not pending:
+        return report
+
+    in_flight = [row.id for row in pending if row.dispatched_at is not None]
+    reserved = [row for row in pending if row.dispatched_at is None]
+
+    if in_flight:
+        # send_gift was called but never answered, telegram may have sent it - never risk a second copy
+        report["assumed_delivered"] = await database.commit_deliveries(in_flight)
+        await logger.awarning(f'interrupted gift sends assumed delivered', deliveries=in_flight)
+
+    if reserved:
+        try:
+            available = {int(item.id): item for item in (await bot.get_available_gifts()).gifts}
+        except Exception as e:
+            # the reservations stay, the next start retries them
+            await logger.aerror(f'Error recovering reserved deliveries: {e}')
+            return report
+
+        refund = [row.id for row in reserved if row.gift_id not in available]
+        report["refunded"] = await database.release_deliveries(refund)
+
+        resend = defaultdict(list)
+        for row in reserved:
+            if row.gift_id in available:
+                resend[row.gift_id].append(row)
+        if resend:
+            report["resent"] = await _resend(bot, logger, available, resend)
+
+    await logger.ainfo(f'delivery recovery finished', **report)
+    return report
+
+
+async def _resend(bot: Bot, logger: FilteringBoundLogger, available: dict, resend: dict) -> int:
+    delivery = bot.config.delivery
+    pool = DeliveryPool(
+        partial(deliver_gift, bot, logger), logger,
+        workers=delivery.workers,
+        queue_size=delivery.queue_size,
+        call_timeout=delivery.call_timeout
+    )
+    pool.start()
+
+    runs = []
+    try:
+        for gift_id, rows in resend.items():
+            item = available[gift_id]
+            run = GiftRun({
+                "id": gift_id,
+                "count": item.total_count or UNLIMITED_SUPPLY,
+                "amount": item.star_count,
+                "supply": item.remaining_count if item.total_count else None
+            })
+            for row in rows:
+                await pool.submit(DeliveryJob(run, row.id, row.user_id))
+            run.seal()
+            runs.append(run)
+
+        for run in runs:
+            await finish_purchase(bot, logger, run)
+    finally:
+        await pool.stop()
+    return sum(run.delivered for run in runs)
@@ -0,0 +1,111 @@
+import asyncio
+import random
+
+from dataclasses import dataclass
+from math import floor
+from time import monotonic
+from typing import Any, Awaitable, Callable
+
+from structlog.typing import FilteringBoundLogger
+
+from src.metrics import POLL_LATENESS
+
+
+@dataclass
+class PollStats:
+    polls: int = 0
+    errors: int = 0
+    skipped_ticks: int = 0
+    last_lateness: float = 0.0
+    max_lateness: float = 0.0
+    total_lateness: float = 0.0
+    last_duration: float = 0.0
+
+    def record(self, lateness: float, duration: float) -> None:
+        self.polls += 1
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+        self.last_duration = duration
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "polls": self.polls,
+            "errors": self.errors,
+            "skipped_ticks": self.skipped_ticks,
+            "mean_lateness": round(self.total_lateness / self.polls, 4) if self.polls else 0.0,
+            "max_lateness": round(self.max_lateness, 4),
+        }
+
+
+class PollScheduler:
+    """Runs `poll` on a fixed monotonic grid, independent of how long each poll takes.
+
+    With several lanes (poll tokens) the tick is interval / lanes, so every lane
+    still polls once per interval but phase-shifted against the others.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            interval: float,
+            poll: Callable[[], Awaitable[None]],
+            logger: FilteringBoundLogger,
+            jitter: float = 0.0,
+            max_backoff: float = 60.0,
+            report_every: int = 500,
+            lanes: Callable[[], int] = lambda: 1
+        ) -> None:
+        self.name = name
+        self.interval = interval
+        self.poll = poll
+        self.logger = logger
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.report_every = report_every
+        self.lanes = lanes
+        self.stats = PollStats()
+
+    @property
+    def tick(self) -> float:
+        return self.interval / max(1, self.lanes())
+
+    async def run(self) -> None:
+        grid = monotonic()
+        failures = 0
+
+        while True:
+            # jitter shifts a single tick, never the grid itself
+            deadline = grid + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            delay = deadline - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            started = monotonic()
+            try:
+                await self.poll()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.stats.errors += 1
+                await self.logger.aerror(f'{self.name} poll failed: {e}', failures=failures)
+
+            finished = monotonic()
+            lateness = max(0.0, started - deadline)
+            self.stats.record(lateness, finished - started)
+            POLL_LATENESS.observe(lateness, self.name)
+            if self.stats.polls % self.report_every == 0:
+                await self.logger.ainfo(f'{self.name} poll scheduler', **self.stats.report())
+
+            if failures:
+                # exponential backoff on api errors, then back onto a fresh grid
+                grid = finished + min(self.max_backoff, self.tick * 2 ** (failures - 1))
+                continue
+
+            tick = self.tick
+            grid += tick
+            if grid < finished:
+                # the poll overran whole ticks: drop them instead of firing a burst
+                missed = floor((finished - grid) / tick) + 1
+                self.stats.skipped_ticks += missed
+                grid += missed * tick
@@ -0,0 +1,37 @@
+import asyncio
+
+from time import monotonic
+from typing import Awaitable, Callable
+
+from structlog.typing import FilteringBoundLogger
+
+from src.metrics import STAGE_RESTARTS
+
+
+async def supervise(
+        name: str,
+        stage: Callable[[], Awaitable[None]],
+        logger: FilteringBoundLogger,
+        max_backoff: float = 60.0,
+        healthy_after: float = 60.0
+    ) -> None:
+    """Runs `stage()` forever: a crash is logged and the stage restarted with exponential backoff.
+
+    A stage that ran for `healthy_after` seconds before crashing starts over from
+    the shortest delay, so one crash a day never waits a minute.
+    """
+    failures = 0
+    while True:
+        started = monotonic()
+        try:
+            await stage()
+            await logger.awarning(f'{name} stage returned, restarting')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if monotonic() - started >= healthy_after:
+                failures = 0
+            failures += 1
+            STAGE_RESTARTS.inc(name)
+            await logger.aexception(f'{name} stage crashed: {e}', failures=failures)
+            await asyncio.sleep(min(max_backoff, 2 ** (failures - 1)))
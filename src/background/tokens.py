@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Optional
+
+from structlog.typing import FilteringBoundLogger
+
+from aiogram import Bot
+from aiogram.types import Gifts
+
+
+@dataclass
+class TokenHealth:
+    bot: Bot
+    name: str
+    polls: int = 0
+    errors: int = 0
+    consecutive_errors: int = 0
+    evicted_until: float = 0.0
+    last_error: Optional[str] = None
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.polls if self.polls else 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.evicted_until
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "token": self.name,
+            "polls": self.polls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 4),
+            "evicted": not self.is_healthy(monotonic())
+        }
+
+
+class PollerPool:
+    """Bot tokens that share get_available_gifts polling, used round-robin."""
+
+    def __init__(
+            self,
+            bots: list[Bot],
+            logger: FilteringBoundLogger,
+            max_consecutive_errors: int = 5,
+            eviction_cooldown: float = 600.0
+        ) -> None:
+        self.tokens = [TokenHealth(bot, self._name(bot)) for bot in bots]
+        self.logger = logger
+        self.max_consecutive_errors = max_consecutive_errors
+        self.eviction_cooldown = eviction_cooldown
+        self._cursor = 0
+
+    @staticmethod
+    def _name(bot: Bot) -> str:
+        # bot id part only, never log the secret
+        return bot.token.split(':')[0]
+
+    @classmethod
+    def from_tokens(cls, main_bot: Bot, tokens: list[str], logger: FilteringBoundLogger, **kwargs) -> "PollerPool":
+        return cls([main_bot, *(Bot(token=token) for token in tokens)], logger, **kwargs)
+
+    def healthy(self) -> list[TokenHealth]:
+        now = monotonic()
+        return [token for token in self.tokens if token.is_healthy(now)]
+
+    def size(self) -> int:
+        return max(1, len(self.healthy()))
+
+    def next(self) -> TokenHealth:
+        healthy = self.healthy() or self.tokens
+        token = healthy[self._cursor % len(healthy)]
+        self._cursor += 1
+        return token
+
+    def record_success(self, token: TokenHealth) -> None:
+        token.polls += 1
+        token.consecutive_errors = 0
+
+    async def record_failure(self, token: TokenHealth, error: Exception) -> None:
+        token.polls += 1
+        token.errors += 1
+        token.consecutive_errors += 1
+        token.last_error = str(error)
+
+        # never evict the last working token, polling must go on
+        if token.consecutive_errors >= self.max_consecutive_errors and len(self.healthy()) > 1:
+            token.evicted_until = monotonic() + self.eviction_cooldown
+            # one more failure after the cooldown evicts it again
+            token.consecutive_errors = self.max_consecutive_errors - 1
+            await self.logger.awarning(
+                f'poll token {token.name} evicted for {self.eviction_cooldown}s', **token.report()
+            )
+
+    async def get_available_gifts(self) -> Gifts:
+        # next healthy token in the rotation, failing over to the others within the same tick
+        last_error = None
+        for _ in range(self.size()):
+            token = self.next()
+            try:
+                result = await token.bot.get_available_gifts()
+            except Exception as e:
+                await self.record_failure(token, e)
+                last_error = e
+                continue
+            self.record_success(token)
+            return result
+        raise last_error
+
+    async def close(self) -> None:
+        # the main bot is owned by main(), only close the auxiliary sessions
+        for token in self.tokens[1:]:
+            await token.bot.session.close()
+
+    def report(self) -> list[dict[str, Any]]:
+        return [token.report() for token in self.tokens]
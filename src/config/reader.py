@@ -1,12 +1,77 @@
 import os 
+from typing import Optional
 
 from pydantic import BaseModel
 from yaml import safe_load
 
 
 class RedisConfig(BaseModel):
-    host: str
-    port: int
+    host: str = 'localhost'
+    port: int = 6379
+    db: int = 0
+
+    max_connections: int = 64
+    socket_timeout: float = 5.0
+    health_check_interval: int = 30
+
+class SQLiteConfig(BaseModel):
+    # unset values are taken from the selected profile
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    busy_timeout: Optional[int] = None # in milliseconds
+    cache_size: Optional[int] = None # pages, negative - in KiB
+    mmap_size: Optional[int] = None # in bytes
+
+class DatabaseConfig(BaseModel):
+    url: str = 'sqlite+aiosqlite:///src/data/database/database_file/database.sqlite'
+    echo: bool = False
+
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30 # in seconds
+    pool_pre_ping: bool = False
+
+    profile: str = 'default' # sqlite pragma preset: default, sniping
+
+    user_index: bool = True # keep user balances in memory for instant eligibility checks, single sqlite process only
+    user_index_reconcile_interval: int = 300 # in seconds
+    user_cache_size: int = 4096 # users kept for profile/settings screens, 0 disables
+    user_cache_ttl: float = 30 # in seconds
+    sqlite: SQLiteConfig = SQLiteConfig()
+
+class ApiConfig(BaseModel):
+    rate: float = 30 # bot api calls per second, all methods together
+    burst: int = 30
+    max_retries: int = 3 # flood waits honoured before a call fails
+
+class DeliveryConfig(BaseModel):
+    workers: int = 16 # concurrent send_gift calls
+    queue_size: int = 1000 # jobs buffered before the reservation stage waits
+    call_timeout: float = 15 # in seconds, per delivery
+    chunk_size: int = 1000 # planned users per chunk, one debit statement per copy count in it
+    max_copies: int = 1 # copies of one gift per user and drop, 0 - as many as the buying mode allows
+    recovery_grace: int = 300 # in seconds, clustered startup leaves younger jobs to their node
+
+class AnnounceConfig(BaseModel):
+    channels: list[int] = [-1002365357206] # chats that get a post for every new gift
+    interval: float = 1.0 # in seconds between posts
+    queue_size: int = 100 # pending posts, newer ones are dropped beyond it
+
+class MetricsConfig(BaseModel):
+    enabled: bool = False # nothing is recorded while disabled
+    host: str = '127.0.0.1'
+    port: int = 9108 # prometheus scrapes http://host:port/metrics
+
+class ClusterConfig(BaseModel):
+    enabled: bool = False
+    node_id: Optional[str] = None # defaults to hostname:pid:random
+    namespace: str = 'gift_sniper' # redis key prefix shared by all nodes
+    lease_ttl: float = 10 # in seconds, leader lease and member liveness
+    heartbeat_interval: float = 3 # in seconds
+    virtual_nodes: int = 64 # points per node on the hash ring
+    event_block: float = 1 # in seconds, blocking read on the event stream
+    replay_window: float = 120 # in seconds, events re-run for users moved by a rebalance
+    handle_updates: bool = True # only one node may receive telegram updates
 
 class Config(BaseModel):
     version: str  
@@ -17,14 +82,24 @@ class Config(BaseModel):
     admin_url: str
     developer: str 
     owner: int
+    users_file: str = 'users.json' # whitelist and admins
 
     vip_poll_interval: int
     default_poll_interval: int 
-    bach_size: int
+    poll_jitter: float = 0.0 # in seconds, random delay added to each poll
+    poll_max_backoff: float = 60 # in seconds, cap for backoff after api errors
+    poll_tokens: list[str] = [] # extra bot tokens used only for polling gifts
+    poll_token_max_errors: int = 5 # consecutive failures before a token is evicted
 
     vip_price: int
 
-    redis: RedisConfig
+    redis: RedisConfig = RedisConfig()
+    database: DatabaseConfig = DatabaseConfig()
+    api: ApiConfig = ApiConfig()
+    delivery: DeliveryConfig = DeliveryConfig()
+    announce: AnnounceConfig = AnnounceConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    cluster: ClusterConfig = ClusterConfig()
 
 class ConfigReader:
     def __init__(self, path: str = 'config.yaml'):
@@ -34,5 +109,15 @@ class ConfigReader:
             with open(path) as config_file:
                 self.data = safe_load(config_file)
 
+        self._apply_env()
+
+    def _apply_env(self):
+        # docker-compose points the bot at its redis service through env
+        redis = self.data['redis'] = self.data.get('redis') or {}
+        if os.getenv('REDIS_HOST'):
+            redis['host'] = os.environ['REDIS_HOST']
+        if os.getenv('REDIS_PORT'):
+            redis['port'] = int(os.environ['REDIS_PORT'])
+
     def _load(self):
         return Config(**self.data)
\ No newline at end of file
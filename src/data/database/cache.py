@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Iterable, Optional
+
+from .models import User
+
+
+class UserCache:
+    """Short lived LRU of User rows for the interface handlers.
+
+    Database drops or refreshes entries on every write, the ttl only
+    bounds how long a change made outside this process can go unseen.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 30.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, User]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, _id: int) -> Optional[User]:
+        item = self._items.get(_id)
+        if item is None:
+            return None
+        expires, user = item
+        if expires < monotonic():
+            del self._items[_id]
+            return None
+        self._items.move_to_end(_id)
+        return user
+
+    def put(self, user: User) -> None:
+        if not self.max_size:
+            return
+        self._items[user.id] = (monotonic() + self.ttl, user)
+        self._items.move_to_end(user.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, _id: int) -> None:
+        self._items.pop(_id, None)
+
+    def invalidate_many(self, ids: Iterable[int]) -> None:
+        if not self._items:
+            return
+        for _id in ids:
+            self._items.pop(_id, None)
+
+    def clear(self) -> None:
+        self._items.clear()
@@ -1,28 +1,106 @@
-from typing import Optional
+import asyncio
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func, select
+from sqlalchemy import Row, Select, bindparam, delete, exists, func, insert, literal, select, true, update
+from sqlalchemy.exc import IntegrityError
 
-from .models import Base, User, Invoice, GiftDelivery
+from .models import Base, BigInt, User, Invoice, GiftDelivery
+from .migrations import run_migrations
+from .engine import create_engine
+from .index import UserIndex
+from .cache import UserCache
+from src.config.reader import DatabaseConfig
 from src.utils import BalanceOperation
+from src.metrics import DATABASE_SECONDS, time_methods
 
 
+@time_methods(DATABASE_SECONDS)
 class Database:
-    def __init__(self):
-        self.engine = create_async_engine(
-            "sqlite+aiosqlite:///src/data/database/database_file/database.sqlite",
-            echo=False 
-        )
+    def __init__(self, config: DatabaseConfig = DatabaseConfig()):
+        self.config = config
+        self.engine = create_engine(config)
+        self.backend = self.engine.dialect.name
+        self.user_index = UserIndex()
+        self.user_cache = UserCache(config.user_cache_size, config.user_cache_ttl)
         self.async_session = sessionmaker(
             self.engine, 
             class_=AsyncSession, 
             expire_on_commit=False
         )
 
-    async def init_db(self):
+    async def init_db(self) -> list[int]:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            return await run_migrations(conn)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    def _index_user(self, user: User):
+        self.user_index.upsert(user.id, user.balance, user.vip, user.buying_mode, user.buying_value)
+        self.user_cache.put(user)
+
+    def _adjust_users(self, user_ids: list[int], delta: int):
+        # balance written in sql only, cached rows are stale now
+        self.user_index.adjust_many(user_ids, delta)
+        self.user_cache.invalidate_many(user_ids)
+
+    def _index_columns(self):
+        return (
+            User.id, User.balance, func.coalesce(User.vip, False),
+            func.coalesce(User.buying_mode, 0), func.coalesce(User.buying_value, 0)
+        )
+
+    async def _stream_columns(self, query, chunk_size: int) -> tuple[array, ...]:
+        # streamed straight into typed columns, never a million row objects at once
+        columns = (array('q'), array('q'), array('b'), array('b'), array('q'))
+        async with self.async_session() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for chunk in result.partitions():
+                for column, values in zip(columns, zip(*chunk)):
+                    column.extend(values)
+        return columns
+
+    async def load_user_index(self, chunk_size: int = 10000, passes: int = 3) -> int:
+        # (re)build the in-memory eligibility index, returns how many entries had drifted
+        columns = self._index_columns()
+        self.user_index.track()
+        try:
+            drift = self.user_index.load(await self._stream_columns(select(*columns), chunk_size))
+
+            # writes that landed while the select ran went to the old arrays and may be
+            # missing from what it read - read those users again until nothing moves
+            touched = self.user_index.untrack()
+            for _ in range(passes):
+                if not touched:
+                    break
+                self.user_index.track()
+                fresh = []
+                async with self.async_session() as session:
+                    ids = list(touched)
+                    for i in range(0, len(ids), chunk_size):
+                        fresh.extend((await session.execute(
+                            select(*columns).where(User.id.in_(ids[i:i + chunk_size]))
+                        )).all())
+                again = self.user_index.untrack()
+                # no await below, no write can slip in between
+                self.user_index.refresh(touched, fresh)
+                touched = again
+            return drift
+        finally:
+            self.user_index.untrack()
+
+    async def get_user_snapshot(self, min_balance: int = 0, chunk_size: int = 10000) -> tuple[Sequence[int], ...]:
+        # (ids, balances, vip, modes, values) columns for the purchase planner
+        if self.user_index.loaded:
+            return self.user_index.snapshot(min_balance)
+        query = select(*self._index_columns()).where(User.balance >= min_balance).order_by(User.balance, User.id)
+        return await self._stream_columns(query, chunk_size)
 
     async def create_user(self, _id: int, initial_balance: float = 0.0) -> Optional[User]:
         async with self.async_session() as session:
@@ -31,9 +109,10 @@ class Database:
             existing_user = result.scalar_one_or_none()
             
             if not existing_user:
-                user = User(id=_id, balance=initial_balance)
+                user = User(id=_id, balance=initial_balance, vip=False, buying_mode=0, buying_value=0)
                 session.add(user)
                 await session.commit()
+                self._index_user(user)
 
     async def update_balance(self, _id: int, amount: float, operation: BalanceOperation = BalanceOperation.SET) -> Optional[User]:
         async with self.async_session() as session:
@@ -51,6 +130,7 @@ class Database:
                         user.balance = amount
                 
                 await session.commit()
+                self._index_user(user)
                 return user
             return None
 
@@ -60,13 +140,26 @@ class Database:
             result = await session.execute(query)
             return result.scalar_one_or_none()
 
+    async def get_cached_user(self, _id: int) -> Optional[User]:
+        # for the interface only, sniping always reads balances from sql
+        user = self.user_cache.get(_id)
+        if user is None:
+            user = await self.get_user(_id)
+            if user is not None:
+                self.user_cache.put(user)
+        return user
+
     async def get_user_count(self) -> int:
+        if self.user_index.loaded:
+            return len(self.user_index)
         async with self.async_session() as session:
             query = select(func.count()).select_from(User)
             result = await session.execute(query)
             return result.scalar_one()
 
     async def get_total_balance(self) -> float:
+        if self.user_index.loaded:
+            return self.user_index.total_balance()
         async with self.async_session() as session:
             query = select(func.sum(User.balance)).select_from(User)
             result = await session.execute(query)
@@ -81,6 +174,7 @@ class Database:
             if user:
                 user.vip = vip_value
                 await session.commit()
+                self._index_user(user)
                 return user
             return None
     
@@ -121,16 +215,6 @@ class Database:
 
                 return result.message_id
     
-    async def get_user_updator(self, only_vip: bool = False) -> list[User]:
-        async with self.async_session() as session:
-            if only_vip:
-                query = select(User).where(User.vip == True)
-            else:
-                query = select(User)
-                
-            result = await session.execute(query)
-            return result.scalars().all()
-
     async def create_gift_delivery(self, gift_id: int, user_id: int) -> GiftDelivery:
         async with self.async_session() as session:
             delivery = GiftDelivery(gift_id=gift_id, user_id=user_id)
@@ -169,6 +253,7 @@ class Database:
             if user and user.balance >= amount:
                 user.balance -= amount
                 await session.commit()
+                self._index_user(user)
                 return True
             
             return False
@@ -177,4 +262,254 @@ class Database:
         async with self.async_session() as session:
             query = select(func.count()).select_from(GiftDelivery).where(GiftDelivery.delivered == True)
             result = await session.execute(query)
-            return result.scalar() or 0
\ No newline at end of file
+            return result.scalar() or 0
+
+    async def reserve_purchase(self, gift_id: int, user_id: int, amount: int) -> Optional[int]:
+        async with self.async_session() as session:
+            # claim the (gift, user) slot and debit in one transaction,
+            # returns the delivery id or None if already claimed / not enough stars
+            claim = insert(GiftDelivery).from_select(
+                ['gift_id', 'user_id', 'amount'],
+                select(literal(gift_id, BigInt), literal(user_id, BigInt), literal(amount)).where(
+                    ~exists().where(
+                        GiftDelivery.gift_id == gift_id,
+                        GiftDelivery.user_id == user_id
+                    )
+                )
+            ).returning(GiftDelivery.id)
+            try:
+                delivery_id = (await session.execute(claim)).scalar_one_or_none()
+            except IntegrityError:
+                # lost the race for the unique (gift, user) slot
+                return None
+            if delivery_id is None:
+                return None
+
+            debit = await session.execute(
+                update(User)
+                .where(User.id == user_id, User.balance >= amount)
+                .values(balance=User.balance - amount)
+            )
+            if debit.rowcount != 1:
+                await session.rollback()
+                return None
+
+            await session.commit()
+            self._adjust_users([user_id], -amount)
+            return delivery_id
+
+    def _eligible_users(self, gift_id: int, amount: int, only_vip: bool = False, user_ids: Optional[Sequence[int]] = None) -> Select:
+        query = select(User.id).where(
+            User.balance >= amount,
+            ~exists().where(
+                GiftDelivery.gift_id == gift_id,
+                GiftDelivery.user_id == User.id
+            )
+        )
+        if only_vip:
+            query = query.where(User.vip == True)
+        if user_ids is not None:
+            query = query.where(User.id.in_(user_ids))
+        return query
+
+    async def reserve_gift_batch(
+            self,
+            gift_id: int,
+            amount: int,
+            only_vip: bool = False,
+            user_ids: Optional[Sequence[int]] = None,
+            copies: int = 1
+        ) -> list[tuple[int, int]]:
+        # every user in the batch buys the same number of copies, so one
+        # statement can check and debit copies * amount for all of them
+        if self.backend == 'postgresql':
+            return await self._reserve_gift_batch_locked(gift_id, amount, only_vip, user_ids, copies)
+
+        cost = amount * copies
+        async with self.async_session() as session:
+            # debit every eligible user in one statement, then claim their
+            # delivery rows in one bulk insert - returns (delivery_id, user_id)
+            user_ids = (await session.execute(
+                update(User)
+                .where(User.id.in_(self._eligible_users(gift_id, cost, only_vip, user_ids)))
+                .values(balance=User.balance - cost)
+                .returning(User.id)
+            )).scalars().all()
+            if not user_ids:
+                return []
+
+            deliveries = (await session.execute(
+                insert(GiftDelivery).returning(
+                    GiftDelivery.id, GiftDelivery.user_id, sort_by_parameter_order=True
+                ),
+                [
+                    {"gift_id": gift_id, "user_id": user_id, "copy": copy, "amount": amount}
+                    for user_id in user_ids for copy in range(copies)
+                ]
+            )).all()
+
+            await session.commit()
+            self._adjust_users(user_ids, -cost)
+            return [(delivery_id, user_id) for delivery_id, user_id in deliveries]
+
+    async def _reserve_gift_batch_locked(
+            self,
+            gift_id: int,
+            amount: int,
+            only_vip: bool,
+            user_ids: Optional[Sequence[int]],
+            copies: int = 1,
+            max_passes: int = 20
+        ) -> list[tuple[int, int]]:
+        # several bot processes may share the ledger: lock, debit and claim in one
+        # statement, skipping users another reservation currently holds
+        cost = amount * copies
+        series = select(func.generate_series(0, copies - 1).label('copy')).subquery('series')
+        reserved = []
+        for _ in range(max_passes):
+            eligible = (
+                self._eligible_users(gift_id, cost, only_vip, user_ids)
+                .order_by(User.id)
+                .with_for_update(skip_locked=True)
+                .cte('eligible')
+            )
+            debited = (
+                update(User)
+                .where(User.id == eligible.c.id)
+                .values(balance=User.balance - cost)
+                .returning(User.id)
+                .cte('debited')
+            )
+            # column defaults are not applied to a select fed by a cte, pass them explicitly
+            claim = insert(GiftDelivery).from_select(
+                ['gift_id', 'user_id', 'copy', 'amount', 'delivered', 'created_at'],
+                select(
+                    literal(gift_id, BigInt), debited.c.id, series.c.copy, literal(amount),
+                    literal(False), literal(datetime.utcnow())
+                ).select_from(debited.join(series, true()))
+            ).returning(GiftDelivery.id, GiftDelivery.user_id)
+
+            async with self.async_session() as session:
+                try:
+                    deliveries = (await session.execute(claim)).all()
+                    await session.commit()
+                except IntegrityError:
+                    # a concurrent reservation claimed one of these users first
+                    await session.rollback()
+                    continue
+
+            if deliveries:
+                reserved.extend((delivery_id, user_id) for delivery_id, user_id in deliveries)
+                self._adjust_users(list({user_id for _, user_id in deliveries}), -cost)
+                continue
+
+            # nothing left to claim, unless skipped rows are still held by someone else
+            async with self.async_session() as session:
+                pending = (await session.execute(
+                    select(self._eligible_users(gift_id, cost, only_vip, user_ids).exists())
+                )).scalar()
+            if not pending:
+                break
+            await asyncio.sleep(0.05)
+
+        return reserved
+
+    async def commit_deliveries(self, delivery_ids: list[int]) -> int:
+        if not delivery_ids:
+            return 0
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(GiftDelivery)
+                .where(GiftDelivery.id.in_(delivery_ids), GiftDelivery.delivered == False)
+                .values(delivered=True)
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def commit_delivery(self, delivery_id: int) -> bool:
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(GiftDelivery)
+                .where(GiftDelivery.id == delivery_id, GiftDelivery.delivered == False)
+                .values(delivered=True)
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def mark_dispatched(self, delivery_id: int) -> bool:
+        # written before send_gift: a row with dispatched_at but not delivered is a send
+        # whose outcome is unknown, one without it was never sent and is safe to retry.
+        # it is also the claim: of two senders (a node and another node's recovery)
+        # only the one that stamps the row may call send_gift
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(GiftDelivery)
+                .where(
+                    GiftDelivery.id == delivery_id,
+                    GiftDelivery.delivered == False,
+                    GiftDelivery.dispatched_at.is_(None)
+                )
+                .values(dispatched_at=datetime.utcnow())
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def get_pending_deliveries(self, older_than: float = 0.0) -> Sequence[Row]:
+        # reservations that were never acknowledged as delivered
+        async with self.async_session() as session:
+            query = select(
+                GiftDelivery.id, GiftDelivery.gift_id, GiftDelivery.user_id,
+                GiftDelivery.amount, GiftDelivery.dispatched_at
+            ).where(GiftDelivery.delivered == False)
+            if older_than:
+                query = query.where(GiftDelivery.created_at <= datetime.utcnow() - timedelta(seconds=older_than))
+            return (await session.execute(query.order_by(GiftDelivery.id))).all()
+
+    async def resolve_unanswered(self, delivery_ids: list[int]) -> tuple[int, int]:
+        # deliveries whose send never returned: never dispatched - refund, dispatched -
+        # telegram may have sent it, same as recovery a second copy is never risked.
+        # returns (refunded, assumed delivered)
+        if not delivery_ids:
+            return 0, 0
+        async with self.async_session() as session:
+            rows = (await session.execute(
+                select(GiftDelivery.id, GiftDelivery.dispatched_at)
+                .where(GiftDelivery.id.in_(delivery_ids), GiftDelivery.delivered == False)
+            )).all()
+        refund = [delivery_id for delivery_id, dispatched_at in rows if dispatched_at is None]
+        sent = [delivery_id for delivery_id, dispatched_at in rows if dispatched_at is not None]
+        return await self.release_deliveries(refund), await self.commit_deliveries(sent)
+
+    async def release_purchase(self, delivery_id: int) -> bool:
+        return await self.release_deliveries([delivery_id]) == 1
+
+    async def release_deliveries(self, delivery_ids: list[int]) -> int:
+        if not delivery_ids:
+            return 0
+        async with self.async_session() as session:
+            # drop reservations that were never sent and give the stars back, one transaction
+            released = (await session.execute(
+                delete(GiftDelivery)
+                .where(GiftDelivery.id.in_(delivery_ids), GiftDelivery.delivered == False)
+                .returning(GiftDelivery.user_id, GiftDelivery.amount)
+            )).all()
+            if not released:
+                return 0
+
+            refunds = Counter()
+            for user_id, amount in released:
+                refunds[user_id] += amount or 0
+            params = [{"user_id": user_id, "refund": refund} for user_id, refund in refunds.items() if refund]
+            if params:
+                users = User.__table__
+                await session.execute(
+                    update(users)
+                    .where(users.c.id == bindparam('user_id'))
+                    .values(balance=users.c.balance + bindparam('refund')),
+                    params
+                )
+            await session.commit()
+
+        for user_id, refund in refunds.items():
+            self._adjust_users([user_id], refund)
+        return len(released)
@@ -0,0 +1,65 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.config.reader import DatabaseConfig
+
+
+# pragma presets, explicit values from the sqlite config section win over them
+SQLITE_PROFILES: dict[str, dict[str, str | int]] = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -16384,
+        "mmap_size": 0,
+    },
+    # many concurrent purchase writers + ui readers on one file:
+    # WAL so readers never wait for writers, NORMAL sync (durable at checkpoint,
+    # safe in WAL), long busy timeout instead of "database is locked",
+    # big page cache and mmap so hot user/delivery pages stay in memory
+    "sniping": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 15000,
+        "cache_size": -131072,
+        "mmap_size": 1 << 30,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 2000,
+    },
+}
+
+
+def sqlite_pragmas(config: DatabaseConfig) -> dict[str, str | int]:
+    if config.profile not in SQLITE_PROFILES:
+        raise ValueError(f'Unknown sqlite profile: {config.profile}')
+
+    pragmas = dict(SQLITE_PROFILES[config.profile])
+    pragmas.update(config.sqlite.model_dump(exclude_unset=True, exclude_none=True))
+    return pragmas
+
+
+def create_engine(config: DatabaseConfig) -> AsyncEngine:
+    url = make_url(config.url)
+    engine = create_async_engine(
+        url,
+        echo=config.echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.pool_size,
+        max_overflow=config.max_overflow,
+        pool_timeout=config.pool_timeout,
+        pool_pre_ping=config.pool_pre_ping
+    )
+
+    if url.get_backend_name() == "sqlite":
+        pragmas = sqlite_pragmas(config)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return engine
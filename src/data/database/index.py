@@ -0,0 +1,194 @@
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+
+Row = tuple[int, int, bool, int, int] # (id, balance, vip, mode, value)
+DTYPES = (np.int64, np.int64, np.int8, np.int8, np.int64)
+
+
+class UserIndex:
+    """Balance-sorted in-memory copy of users, "who can pay N stars" is one searchsorted.
+
+    Only a read-side cache: Database updates it on every write and reloads it periodically.
+    Debits are added to a delta column and user writes kept in a small overlay, both
+    are merged into the sorted numpy columns in one vectorized pass on the next read,
+    so a drop debiting thousands of users per batch never re-sorts in between.
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._touched: Optional[set[int]] = None # ids written while a reload reads sql
+        empty = tuple(np.empty(0, dtype) for dtype in DTYPES)
+        self._set(empty, np.empty(0, np.int64))
+
+    def _set(self, columns: tuple[np.ndarray, ...], by_id: np.ndarray) -> None:
+        # columns are only ever replaced, never written in place, so handed out snapshots stay valid
+        self._ids, self._balances, self._vip, self._modes, self._values = columns
+        self._by_id = by_id # positions in id order, for lookups
+        self._sorted_ids = self._ids[by_id]
+        self._delta = np.zeros(len(self._ids), np.int64) # pending debits per position
+        self._overlay: dict[int, Optional[Row]] = {} # written since the last merge, None is removed
+        self._dirty = False
+
+    @staticmethod
+    def _ordered(columns: tuple[np.ndarray, ...], by_id: np.ndarray) -> tuple[tuple[np.ndarray, ...], np.ndarray]:
+        # (balance, id) order: a stable sort by balance of the rows in id order (ids are
+        # unique, any sort gives that one), no lexsort
+        order = by_id[np.argsort(columns[1][by_id], kind='stable')]
+        rank = np.empty(len(order), np.int64)
+        rank[order] = np.arange(len(order))
+        return tuple(column[order] for column in columns), rank[by_id]
+
+    def __len__(self) -> int:
+        self._merge()
+        return len(self._ids)
+
+    def load(self, columns: Sequence[Sequence[int]]) -> int:
+        """Replace the content with (ids, balances, vip, modes, values) columns, returns drifted entries."""
+        columns = tuple(np.asarray(column, dtype=dtype) for column, dtype in zip(columns, DTYPES))
+        columns, by_id = self._ordered(columns, np.argsort(columns[0]))
+
+        drift = 0
+        if self.loaded:
+            self._merge()
+            drift = self._drift(columns[0][by_id], columns[1][by_id])
+        self._set(columns, by_id)
+        self.loaded = True
+        return drift
+
+    def _drift(self, ids: np.ndarray, balances: np.ndarray) -> int:
+        # users whose balance moved, appeared or disappeared, both sides in id order
+        common, old, new = np.intersect1d(self._sorted_ids, ids, assume_unique=True, return_indices=True)
+        changed = np.count_nonzero(self._balances[self._by_id[old]] != balances[new])
+        return int(changed + len(self._ids) + len(ids) - 2 * len(common))
+
+    def track(self) -> None:
+        self._touched = set()
+
+    def untrack(self) -> set[int]:
+        touched, self._touched = self._touched or set(), None
+        return touched
+
+    def _positions(self, ids: Sequence[int]) -> np.ndarray:
+        # column positions of `ids`, -1 for ids not in the columns
+        wanted = np.fromiter(ids, np.int64, len(ids))
+        if not len(self._sorted_ids):
+            return np.full(len(wanted), -1)
+        found = np.minimum(np.searchsorted(self._sorted_ids, wanted), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[found] == wanted, self._by_id[found], -1)
+
+    def _merge(self) -> None:
+        if not self._dirty:
+            return
+        columns = [column.copy() for column in (self._ids, self._balances, self._vip, self._modes, self._values)]
+        columns[1] += self._delta
+        keep, added = None, []
+        if self._overlay:
+            positions = self._positions(list(self._overlay)).tolist()
+            removed = []
+            for (_id, row), pos in zip(self._overlay.items(), positions):
+                if row is None:
+                    if pos >= 0:
+                        removed.append(pos)
+                elif pos >= 0:
+                    for column, value in zip(columns, row):
+                        column[pos] = value
+                else:
+                    added.append(row)
+            if removed:
+                keep = np.ones(len(self._ids), bool)
+                keep[removed] = False
+
+        by_id = self._by_id
+        if keep is not None or added:
+            extra = [np.asarray(values, dtype=dtype) for values, dtype in zip(zip(*added) if added else ((),) * 5, DTYPES)]
+            columns = [np.concatenate((column if keep is None else column[keep], values)) for column, values in zip(columns, extra)]
+            by_id = np.argsort(columns[0])
+        self._set(*self._ordered(tuple(columns), by_id))
+
+    def _row(self, pos: int) -> Row:
+        return (
+            int(self._ids[pos]), int(self._balances[pos] + self._delta[pos]), bool(self._vip[pos]),
+            int(self._modes[pos]), int(self._values[pos])
+        )
+
+    def get(self, _id: int) -> Optional[Row]:
+        if _id in self._overlay:
+            return self._overlay[_id]
+        pos = int(self._positions((_id,))[0])
+        return self._row(pos) if pos >= 0 else None
+
+    def remove(self, _id: int) -> None:
+        if self._touched is not None:
+            self._touched.add(_id)
+        if not self.loaded:
+            return
+        self._overlay[_id] = None
+        self._dirty = True
+
+    def upsert(
+            self,
+            _id: int,
+            balance: Optional[int] = None,
+            vip: Optional[bool] = None,
+            mode: Optional[int] = None,
+            value: Optional[int] = None
+        ) -> None:
+        if self._touched is not None:
+            self._touched.add(_id)
+        # nothing to keep in sync before the first load (or ever, on a shared ledger)
+        if not self.loaded:
+            return
+        current = self.get(_id)
+        if current is not None:
+            _, old_balance, old_vip, old_mode, old_value = current
+            balance = old_balance if balance is None else balance
+            vip = old_vip if vip is None else vip
+            mode = old_mode if mode is None else mode
+            value = old_value if value is None else value
+        # the overlay row is absolute, it wins over any debit still in the delta column
+        self._overlay[_id] = (_id, int(balance or 0), bool(vip), int(mode or 0), int(value or 0))
+        self._dirty = True
+
+    def refresh(self, ids: Iterable[int], rows: Iterable[Row]) -> None:
+        """Overwrite `ids` with fresh (id, balance, vip, mode, value) rows, ids without a row are dropped."""
+        missing = set(ids)
+        for _id, balance, vip, mode, value in rows:
+            missing.discard(_id)
+            self.upsert(_id, balance, vip, mode, value)
+        for _id in missing:
+            self.remove(_id)
+
+    def adjust(self, _id: int, delta: int) -> None:
+        self.adjust_many((_id,), delta)
+
+    def adjust_many(self, ids: Iterable[int], delta: int) -> None:
+        ids = set(ids)
+        if self._touched is not None:
+            self._touched.update(ids)
+        if not self.loaded or not delta:
+            return
+        in_columns = []
+        for _id in ids:
+            if _id not in self._overlay:
+                in_columns.append(_id)
+            elif self._overlay[_id] is not None:
+                _, balance, vip, mode, value = self._overlay[_id]
+                self._overlay[_id] = (_id, balance + delta, vip, mode, value)
+        positions = self._positions(in_columns)
+        self._delta[positions[positions >= 0]] += delta
+        self._dirty = True
+
+    def total_balance(self) -> int:
+        self._merge()
+        return int(self._balances.sum())
+
+    def snapshot(self, min_balance: int = 0) -> tuple[np.ndarray, ...]:
+        """(id, balance, vip, mode, value) columns for users with balance >= min_balance."""
+        self._merge()
+        start = int(np.searchsorted(self._balances, min_balance))
+        return (
+            self._ids[start:], self._balances[start:], self._vip[start:],
+            self._modes[start:], self._values[start:]
+        )
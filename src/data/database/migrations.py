@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import Connection, insert, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .models import SchemaMigration
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+# create_all only creates missing tables, so every change to an existing
+# table goes here. upgrades must be idempotent: on a fresh database
+# create_all has already built the latest schema before they run
+
+def _delivery_and_user_indexes(conn: Connection):
+    # older versions could insert the same (gift, user) pair twice,
+    # keep the delivered row (or the first one) before adding the unique index
+    conn.execute(text(
+        "DELETE FROM gift_deliveries WHERE id NOT IN ("
+        " SELECT COALESCE(MIN(CASE WHEN delivered THEN id END), MIN(id))"
+        " FROM gift_deliveries GROUP BY gift_id, user_id"
+        ")"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_gift_deliveries_gift_user "
+        "ON gift_deliveries (gift_id, user_id)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_balance ON users (balance)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_vip_balance ON users (vip, balance)"))
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> bool:
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _delivery_outbox(conn: Connection):
+    _add_column(conn, 'gift_deliveries', 'amount', 'INTEGER DEFAULT 0')
+    if _add_column(conn, 'gift_deliveries', 'dispatched_at', 'TIMESTAMP'):
+        # the old flow created the row before checking the balance, so an
+        # undelivered one is mostly a user who couldn't pay - nothing was debited
+        # (amount is unknown) or sent. recovery must neither commit nor resend it
+        conn.execute(text("DELETE FROM gift_deliveries WHERE NOT delivered"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_gift_deliveries_delivered ON gift_deliveries (delivered)"
+    ))
+
+
+def _delivery_copies(conn: Connection):
+    _add_column(conn, 'gift_deliveries', 'copy', 'INTEGER DEFAULT 0')
+    conn.execute(text("UPDATE gift_deliveries SET copy = 0 WHERE copy IS NULL"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_gift_deliveries_gift_user_copy "
+        "ON gift_deliveries (gift_id, user_id, copy)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ux_gift_deliveries_gift_user"))
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, 'delivery and user indexes', _delivery_and_user_indexes),
+    Migration(2, 'delivery outbox columns', _delivery_outbox),
+    Migration(3, 'several copies per delivery', _delivery_copies),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> list[int]:
+    applied = set((await conn.execute(select(SchemaMigration.version))).scalars())
+
+    done = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in applied:
+            continue
+
+        await conn.run_sync(migration.upgrade)
+        await conn.execute(
+            insert(SchemaMigration).values(version=migration.version, name=migration.name)
+        )
+        done.append(migration.version)
+    return done
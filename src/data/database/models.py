@@ -1,19 +1,28 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, Boolean, DateTime 
+from sqlalchemy import Column, Integer, BigInteger, Boolean, DateTime, String, Index
 from datetime import datetime
 
 
 Base = declarative_base()
 
+# telegram user and gift ids don't fit in int4 on postgres,
+# sqlite keeps INTEGER so primary keys stay rowid aliases
+BigInt = BigInteger().with_variant(Integer, 'sqlite')
+
 class User(Base):
     __tablename__ = 'users'
 
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInt, primary_key=True, autoincrement=False)
     balance = Column(Integer, default=0)
     vip = Column(Boolean, default=False)
     buying_mode = Column(Integer, default=0) # 0 - all in, 1 - percent limit, 2 - stars limit
     buying_value = Column(Integer, default=0)
 
+    __table_args__ = (
+        Index('ix_users_balance', 'balance'),
+        Index('ix_users_vip_balance', 'vip', 'balance'),
+    )
+
     def __repr__(self): # for pretty info in print 
         return f"<User(id={self.id}, balance={self.balance}, vip={self.vip})>"
     
@@ -31,8 +40,23 @@ class Invoice(Base):
 class GiftDelivery(Base):
     __tablename__ = 'gift_deliveries'
     
-    id = Column(Integer, primary_key=True)
-    gift_id = Column(Integer)
-    user_id = Column(Integer)
+    id = Column(BigInt, primary_key=True)
+    gift_id = Column(BigInt)
+    user_id = Column(BigInt)
+    copy = Column(Integer, default=0) # n-th copy of the gift bought for this user
+    amount = Column(Integer, default=0) # stars debited for it, refunded if it is released
     delivered = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    dispatched_at = Column(DateTime, nullable=True, default=None) # set right before send_gift
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ux_gift_deliveries_gift_user_copy', 'gift_id', 'user_id', 'copy', unique=True),
+        Index('ix_gift_deliveries_delivered', 'delivered'),
+    )
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255))
+    applied_at = Column(DateTime, default=datetime.utcnow)
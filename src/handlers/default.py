@@ -1,12 +1,12 @@
-import json
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command, StateFilter
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from src.data import Text, Markup
-from src.utils import DefaultUtils, CustomCall
+from src.utils import DefaultUtils, CustomCall, AccessControl
 from src.states import PaymentsStates
+from src.data.database import User
 
 from src.handlers.profile import profile_handler
 from src.handlers.info import stats_handler
@@ -14,57 +14,6 @@ from src.handlers.info import stats_handler
 rname = 'based'
 router = Router()
 
-USERS_FILE = "users.json"
-
-def load_users():
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        data = {"whitelist": [], "admins": []}
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        return data
-
-
-def save_users(data):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def is_admin(user_id: int, data=None) -> bool:
-    data = data or load_users()
-    return user_id in data.get("admins", [])
-
-
-def is_whitelisted(user_id: int, data=None) -> bool:
-    data = data or load_users()
-    return user_id in data.get("whitelist", [])
-
-
-async def check_access(message: Message) -> bool:
-    data = load_users()
-    if is_admin(message.from_user.id, data) or is_whitelisted(message.from_user.id, data):
-        return True
-    await message.answer(
-        f"❌ У Вас нет доступа к приватному боту\n\n"
-        f"На данный момент доступ имеет {len(data.get('whitelist', []))} человек",
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return False
-
-
-async def check_access_callback(call: CallbackQuery) -> bool:
-    data = load_users()
-    if is_admin(call.from_user.id, data) or is_whitelisted(call.from_user.id, data):
-        return True
-    await call.answer(
-        f"❌ У Вас нет доступа к приватному боту\n\n"
-        f"На данный момент доступ имеет {len(data.get('whitelist', []))} человек",
-        show_alert=True
-    )
-    return False
-
 @router.callback_query(F.data == 'faq')
 async def new_top_up_handler(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text(
@@ -74,8 +23,6 @@ async def new_top_up_handler(call: CallbackQuery, state: FSMContext):
 
 @router.message(CommandStart())
 async def start_handler(message: Message):
-    if not await check_access(message):
-        return
     await message.bot.database.create_user(message.from_user.id)
     await message.answer(
         text=Text.start.format(user=DefaultUtils.remove_html_tags(message.from_user.full_name)),
@@ -84,21 +31,17 @@ async def start_handler(message: Message):
 
 
 @router.callback_query(F.data.split('|')[0] == 'back')
-async def back_handler(call: CallbackQuery, state: FSMContext):
-    if not await check_access_callback(call):
-        return
+async def back_handler(call: CallbackQuery, state: FSMContext, user: User):
     await state.clear()
     back_argument = call.data.split('|')[1]
     if back_argument == 'profile':
-        await profile_handler(CustomCall(call))
+        await profile_handler(CustomCall(call), user)
     elif back_argument == 'info':
         await info_handler(CustomCall(call))
 
 
 @router.message(F.text == 'Отмена', StateFilter(PaymentsStates.wait_payment))
 async def cancel_handler_invoice(message: Message, state: FSMContext):
-    if not await check_access(message):
-        return
     invoice_id = (await state.get_data())["invoice_id"]
     invoice_message_id = await message.bot.database.get_invoice_message_id(invoice_id, False)
 
@@ -112,47 +55,37 @@ async def cancel_handler_invoice(message: Message, state: FSMContext):
 
 @router.callback_query(F.data == 'mode')
 async def in_development_handler(call: CallbackQuery):
-    if not await check_access_callback(call):
-        return
     await call.answer(
         text=Text.in_development, show_alert=True
     )
 
 @router.callback_query(F.data == 'refundform')
 async def in_development_handler(call: CallbackQuery):
-    if not await check_access_callback(call):
-        return
     await call.answer(
         text=Text.in_development_form, show_alert=True
     )
 
 @router.message(Command("add"))
-async def add_user(message: Message):
-    data = load_users()
-    if not is_admin(message.from_user.id, data):
+async def add_user(message: Message, access: AccessControl):
+    if not access.is_admin(message.from_user.id):
         return
     args = message.text.split()
     if len(args) != 2 or not args[1].isdigit():
         return await message.answer("⚠️ Использование: /add [user_id]")
     user_id = int(args[1])
-    if user_id in data["whitelist"]:
+    if not await access.add(user_id):
         return await message.answer("❌ Пользователь уже в вайтлисте.")
-    data["whitelist"].append(user_id)
-    save_users(data)
     await message.answer(f"✅ Пользователь {user_id} добавлен в вайтлист.")
 
 
 @router.message(Command("remove"))
-async def remove_user(message: Message):
-    data = load_users()
-    if not is_admin(message.from_user.id, data):
+async def remove_user(message: Message, access: AccessControl):
+    if not access.is_admin(message.from_user.id):
         return
     args = message.text.split()
     if len(args) != 2 or not args[1].isdigit():
         return await message.answer("⚠️ Использование: /remove [user_id]")
     user_id = int(args[1])
-    if user_id not in data["whitelist"]:
+    if not await access.remove(user_id):
         return await message.answer("❌ Пользователя нет в вайтлисте.")
-    data["whitelist"].remove(user_id)
-    save_users(data)
     await message.answer(f"✅ Пользователь {user_id} удалён из вайтлиста.")
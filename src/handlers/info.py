@@ -1,4 +1,3 @@
-import json
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.types import Message, CallbackQuery
@@ -6,44 +5,18 @@ from aiogram.fsm.context import FSMContext
 
 from src.data import Text, Markup
 from src.config import Config
-from src.utils import DefaultUtils, CustomCall, CustomMessage
+from src.utils import DefaultUtils, CustomCall, CustomMessage, AccessControl
 from src.states import PaymentsStates
-from src.data.database import Database
-
-USERS_FILE = "users.json"
+from src.data.database import Database, User
 
 rname = 'info'
 router = Router()
 
-def load_users():
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        data = {"whitelist": [], "admins": []}
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        return data
-
-
-def save_users(data):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def is_admin(user_id: int, data=None) -> bool:
-    data = data or load_users()
-    return user_id in data.get("admins", [])
-
 @router.message(Command("stats"))
-async def stats_handler(message: Message):
-    data = load_users()
-    if not is_admin(message.from_user.id, data):
+async def stats_handler(message: Message, access: AccessControl, user: User):
+    if not access.is_admin(message.from_user.id):
         return
     config: Config = message.bot.config
-    user = await message.bot.database.get_user(
-        message.from_user.id
-    )
 
     await message.answer(
         text=Text.info.format(
@@ -56,10 +29,7 @@ async def stats_handler(message: Message):
     )
 
 @router.callback_query(F.data == 'settings')
-async def settings_handler(call: CallbackQuery):
-    user = await call.bot.database.get_user(
-        call.from_user.id
-    )
+async def settings_handler(call: CallbackQuery, user: User):
     await call.message.edit_text(
         text=Text.info_setting,
         reply_markup=Markup.setting_generator(user.buying_mode)
@@ -1,4 +1,3 @@
-import json
 from aiogram import Router, F
 from aiogram.filters import StateFilter, Command
 from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
@@ -6,33 +5,12 @@ from aiogram.fsm.context import FSMContext
 
 from src.data import Text, Markup
 from src.states import PaymentsStates
-from src.utils import BalanceOperation
+from src.utils import BalanceOperation, AccessControl
+from src.data.database import User
 
 rname = 'payments'
 router = Router()
 
-USERS_FILE = "users.json"
-
-def load_users():
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        data = {"whitelist": [], "admins": []}
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        return data
-
-
-def save_users(data):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def is_admin(user_id: int, data=None) -> bool:
-    data = data or load_users()
-    return user_id in data.get("admins", [])
-
 @router.callback_query(F.data == 'top_up')
 async def new_top_up_handler(call: CallbackQuery, state: FSMContext):
     back_message = await call.message.edit_text(
@@ -45,11 +23,10 @@ async def new_top_up_handler(call: CallbackQuery, state: FSMContext):
     })
 
 @router.message(Command("refund"))
-async def refund_command(message: Message):
+async def refund_command(message: Message, access: AccessControl):
     args = message.text.split()
 
-    data = load_users()
-    if not is_admin(message.from_user.id, data):
+    if not access.is_admin(message.from_user.id):
         return await message.answer("⛔️ У тебя нет прав для этой команды.")
 
     if len(args) != 3:
@@ -191,25 +168,21 @@ async def vip_info_handler(call: CallbackQuery):
 
 
 @router.callback_query(F.data == 'invoice_buy_vip')
-async def vip_buy_handler(call: CallbackQuery):
-    user_db = await call.bot.database.get_user(call.from_user.id)
-    
-    if user_db.vip:
+async def vip_buy_handler(call: CallbackQuery, user: User):
+    if user.vip:
         return await call.answer(
             text=Text.errors.already_buy, show_alert=True
         )
 
-    if user_db.balance < call.bot.config.vip_price:
+    # the cached row may be a few seconds old, the debit re-checks the balance
+    if user.balance < call.bot.config.vip_price or not await call.bot.database.user_buy_gift(
+        call.bot.config.vip_price, call.from_user.id
+    ):
         return await call.answer(
             text=Text.errors.insufficient_funds,
             show_alert=True
         )
     
-    await call.bot.database.update_balance(
-        call.from_user.id, 
-        call.bot.config.vip_price,
-        operation=BalanceOperation.SUBTRACT
-    )
     await call.bot.database.grant_vip(call.from_user.id, True)
     
     await call.message.edit_text(
@@ -11,16 +11,13 @@ router = Router()
 
 
 @router.message(F.text == '👤 Профиль')
-async def profile_handler(message: Message):
-    user_info: User = await message.bot.database.get_user(
-        message.from_user.id
-    )
+async def profile_handler(message: Message, user: User):
     await message.answer(
         text=Text.profile.format(
             user=DefaultUtils.remove_html_tags(message.from_user.full_name),
             id=message.from_user.id,
-            balance=int(user_info.balance),
-            status_vip=Text.utils.bool_to_emoji(user_info.vip),
+            balance=int(user.balance),
+            status_vip=Text.utils.bool_to_emoji(user.vip),
             default_interval=message.bot.config.default_poll_interval,
             vip_interval=message.bot.config.vip_poll_interval
         ),
@@ -0,0 +1,44 @@
+from src.metrics.registry import Counter, Gauge, Histogram, Registry, time_methods
+from src.metrics.server import start_metrics_server
+
+REGISTRY = Registry()
+
+# from a gift showing up to users owning it, these run up to minutes on big drops
+DROP_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+POLL_SECONDS = REGISTRY.histogram(
+    'gift_poll_seconds', 'get_available_gifts round trip.', ('tier',)
+)
+POLL_LATENESS = REGISTRY.histogram(
+    'gift_poll_lateness_seconds', 'How late a poll started against its schedule.', ('tier',)
+)
+DETECTION_TO_FIRST_DELIVERY = REGISTRY.histogram(
+    'gift_detection_to_first_delivery_seconds', 'From detecting a gift to its first delivered copy.',
+    buckets=DROP_BUCKETS
+)
+DETECTION_TO_LAST_DELIVERY = REGISTRY.histogram(
+    'gift_detection_to_last_delivery_seconds', 'From detecting a gift to its last delivered copy.',
+    buckets=DROP_BUCKETS
+)
+SEND_GIFT_SECONDS = REGISTRY.histogram(
+    'send_gift_seconds', 'send_gift round trip, including limiter waits.', ('result',)
+)
+SEND_GIFT_ERRORS = REGISTRY.counter(
+    'send_gift_errors_total', 'Failed send_gift calls by error type.', ('error',)
+)
+DATABASE_SECONDS = REGISTRY.histogram(
+    'database_method_seconds', 'Duration of Database methods.', ('method',)
+)
+STAGE_RESTARTS = REGISTRY.counter(
+    'stage_restarts_total', 'Background stages restarted after crashing.', ('stage',)
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    'queue_depth', 'Items waiting in an internal queue.', ('queue',)
+)
+
+__all__ = [
+    "Counter", "Gauge", "Histogram", "Registry", "time_methods", "start_metrics_server",
+    "REGISTRY", "POLL_SECONDS", "POLL_LATENESS", "DETECTION_TO_FIRST_DELIVERY",
+    "DETECTION_TO_LAST_DELIVERY", "SEND_GIFT_SECONDS", "SEND_GIFT_ERRORS",
+    "DATABASE_SECONDS", "STAGE_RESTARTS", "QUEUE_DEPTH"
+]
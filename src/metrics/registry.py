@@ -0,0 +1,171 @@
+import inspect
+
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Iterable, Optional
+
+
+# seconds, from a cached lookup to a slow flood wait
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, registry: "Registry", name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if not self.registry.enabled:
+            return
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # labels -> [per bucket counts..., sum, count]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        if not self.registry.enabled:
+            return
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        size = len(self.buckets)
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, hits in zip(self.buckets, series[:size]):
+                cumulative += hits
+                le = f'le="{_number(bound)}"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}'
+
+
+class Gauge(Metric):
+    """Read at scrape time from callbacks, nothing is recorded on the hot path."""
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._callbacks: dict[tuple, Callable[[], float]] = {}
+
+    def track(self, callback: Callable[[], float], *labels) -> None:
+        self._callbacks[labels] = callback
+
+    def samples(self) -> Iterable[str]:
+        for labels, callback in list(self._callbacks.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Registry:
+    """Process wide metrics. While disabled every record call returns on its first line."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.metrics: list[Metric] = []
+
+    def _add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+        ) -> Histogram:
+        return self._add(Histogram(self, name, documentation, labelnames, buckets=buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(self, name, documentation, labelnames))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+def time_methods(histogram: Histogram, exclude: Optional[set[str]] = None) -> Callable[[type], type]:
+    """Class decorator: every public coroutine method observes its duration, labeled by method name."""
+    exclude = exclude or set()
+
+    def decorate(cls: type) -> type:
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, _timed(method, name, histogram))
+        return cls
+    return decorate
+
+
+def _timed(method: Callable, name: str, histogram: Histogram) -> Callable:
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not histogram.registry.enabled:
+            return await method(*args, **kwargs)
+        started = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - started, name)
+    return wrapper
@@ -0,0 +1,19 @@
+from aiohttp import web
+
+from src.metrics.registry import Registry
+
+
+async def start_metrics_server(registry: Registry, host: str = '127.0.0.1', port: int = 9108) -> web.AppRunner:
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
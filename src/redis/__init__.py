@@ -1,5 +1,6 @@
 from src.redis.cache import RedisStorage
+from src.redis.cluster import ClusterCoordinator, HashRing
 
 __all__ = [
-    "RedisStorage"
+    "RedisStorage", "ClusterCoordinator", "HashRing"
 ]
\ No newline at end of file
@@ -1,55 +1,98 @@
 import json
 
-from typing import List
-from redis import Redis
+from typing import Iterable, List
+from redis.asyncio import ConnectionPool, Redis
+
+from src.config.reader import RedisConfig
 
 
 class RedisStorage:
-    def __init__(self, host: str, port: int) -> None:
-        self.redis = Redis(
-            host=host, port=port, decode_responses=True
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            db: int = 0,
+            max_connections: int = 64,
+            socket_timeout: float = 5.0,
+            health_check_interval: int = 30
+        ) -> None:
+        # one pool per process, every coroutine borrows a connection from it
+        self.pool = ConnectionPool(
+            host=host, port=port, db=db,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+            health_check_interval=health_check_interval,
+            decode_responses=True
         )
-        self.vip_gifts_key = "vip_gifts_list"
-        self.default_gifts_key = "default_gifts_list"
+        self.redis = Redis(connection_pool=self.pool)
+        self.vip_gifts_key = "vip_gifts_set"
+        self.default_gifts_key = "default_gifts_set"
 
-    def get_gifts(self, vip: bool = False) -> List[int]:
-        if vip:
-            # FOR VIP ONLY
-            gifts = self.redis.get(self.vip_gifts_key)
-            return json.loads(gifts) if gifts else []
-        else:
-            # FOR DEFAULT ONLY
-            gifts = self.redis.get(self.default_gifts_key)
-            return json.loads(gifts) if gifts else []
-
-    def add_gift(self, gift_id: int, vip: bool = False) -> bool:
+    @classmethod
+    def from_config(cls, config: RedisConfig) -> "RedisStorage":
+        return cls(**config.model_dump())
+
+    async def connect(self) -> None:
+        await self.redis.ping()
+        await self._migrate_legacy_lists()
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+        await self.pool.aclose()
+
+    async def _migrate_legacy_lists(self) -> None:
+        # old versions kept gift ids as a json list in a plain string key
+        legacy_keys = {
+            self.vip_gifts_key: "vip_gifts_list",
+            self.default_gifts_key: "default_gifts_list"
+        }
+        for key, legacy_key in legacy_keys.items():
+            gifts = await self.redis.get(legacy_key)
+            if gifts is None:
+                continue
+
+            gift_ids = json.loads(gifts)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if gift_ids:
+                    pipe.sadd(key, *gift_ids)
+                pipe.delete(legacy_key)
+                await pipe.execute()
+
+    def _gift_keys(self, vip: bool) -> List[str]:
         if vip:
-            # VIP = RICH, ONLY VIP CREATED 
-            vip_gifts = self.get_gifts(vip=True)
-            if gift_id not in vip_gifts:
-                vip_gifts.append(gift_id)
-                return self.redis.set(self.vip_gifts_key, json.dumps(vip_gifts))
-        else:
-            # NOT VIP = SHAWTY, VIP AND DEFAULT CREATED
-            added = False
-            
-            vip_gifts = self.get_gifts(vip=True)
-            if gift_id not in vip_gifts:
-                vip_gifts.append(gift_id)
-                self.redis.set(self.vip_gifts_key, json.dumps(vip_gifts))
-                added = True
-            
-            default_gifts = self.get_gifts(vip=False)
-            if gift_id not in default_gifts:
-                default_gifts.append(gift_id)
-                self.redis.set(self.default_gifts_key, json.dumps(default_gifts))
-                added = True
-            
-            return added
-        return False
-
-    def clear_gifts(self) -> bool:
-        return all([
-            self.redis.delete(self.vip_gifts_key),
-            self.redis.delete(self.default_gifts_key)
-        ]) 
\ No newline at end of file
+            # VIP = RICH, ONLY VIP CREATED
+            return [self.vip_gifts_key]
+        # NOT VIP = SHAWTY, VIP AND DEFAULT CREATED
+        return [self.vip_gifts_key, self.default_gifts_key]
+
+    async def get_gifts(self, vip: bool = False) -> List[int]:
+        key = self.vip_gifts_key if vip else self.default_gifts_key
+        return [int(gift_id) for gift_id in await self.redis.smembers(key)]
+
+    async def register_gifts(self, gift_ids: Iterable[int], vip: bool = False) -> List[int]:
+        """Add gift ids to the registry in one round trip, return only the new ones."""
+        gift_ids = list(dict.fromkeys(int(gift_id) for gift_id in gift_ids))
+        if not gift_ids:
+            return []
+
+        keys = self._gift_keys(vip)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for gift_id in gift_ids:
+                for key in keys:
+                    pipe.sadd(key, gift_id)
+            added = await pipe.execute()
+
+        # SADD returns 1 only for the client that actually inserted the member,
+        # so concurrent pollers can never both claim the same drop
+        step = len(keys)
+        return [
+            gift_id for i, gift_id in enumerate(gift_ids)
+            if any(added[i * step:(i + 1) * step])
+        ]
+
+    async def add_gift(self, gift_id: int, vip: bool = False) -> bool:
+        return bool(await self.register_gifts([gift_id], vip=vip))
+
+    async def clear_gifts(self) -> bool:
+        return bool(await self.redis.delete(self.vip_gifts_key, self.default_gifts_key))
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import socket
+
+from bisect import bisect_right
+from hashlib import blake2b
+from time import monotonic, time
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from redis.asyncio import Redis
+from structlog.typing import FilteringBoundLogger
+
+from src.config.reader import ClusterConfig
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash of user ids over cluster members."""
+
+    def __init__(self, members: list[str], virtual_nodes: int = 64) -> None:
+        self.members = sorted(members)
+        points = sorted(
+            (_hash(f'{member}#{i}'), member)
+            for member in self.members
+            for i in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, user_id: int) -> Optional[str]:
+        if not self._keys:
+            return None
+        pos = bisect_right(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._owners[pos]
+
+
+class ClusterCoordinator:
+    """Membership, leader lease and new-gift events for several bot processes sharing one redis."""
+
+    RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis: Redis, config: ClusterConfig, logger: FilteringBoundLogger) -> None:
+        self.redis = redis
+        self.config = config
+        self.logger = logger
+        self.node_id = config.node_id or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}'
+
+        self.members_key = f'{config.namespace}:members'
+        self.leader_key = f'{config.namespace}:leader'
+        self.events_key = f'{config.namespace}:gift_events'
+
+        self.is_leader = False
+        self.ring = HashRing([self.node_id], config.virtual_nodes)
+        self._renew = self.redis.register_script(self.RENEW_SCRIPT)
+        self._release = self.redis.register_script(self.RELEASE_SCRIPT)
+        self._ring_listeners: list[Callable[[], Awaitable[None]]] = []
+
+    def owns(self, user_id: int) -> bool:
+        return self.ring.owner(user_id) == self.node_id
+
+    def on_rebalance(self, callback: Callable[[], Awaitable[None]]) -> None:
+        self._ring_listeners.append(callback)
+
+    async def _heartbeat(self) -> None:
+        now = time()
+        ttl = self.config.lease_ttl
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.members_key, {self.node_id: now})
+            pipe.zremrangebyscore(self.members_key, '-inf', now - ttl)
+            pipe.zrange(self.members_key, 0, -1)
+            *_, members = await pipe.execute()
+
+        if sorted(members) != self.ring.members:
+            self.ring = HashRing(members, self.config.virtual_nodes)
+            await self.logger.ainfo(f'cluster membership changed', members=self.ring.members, node=self.node_id)
+            for callback in self._ring_listeners:
+                await callback()
+
+    async def _elect(self) -> None:
+        ttl_ms = int(self.config.lease_ttl * 1000)
+        if self.is_leader:
+            leader = bool(await self._renew(keys=[self.leader_key], args=[self.node_id, ttl_ms]))
+        else:
+            leader = bool(await self.redis.set(self.leader_key, self.node_id, nx=True, px=ttl_ms))
+
+        if leader != self.is_leader:
+            self.is_leader = leader
+            await self.logger.ainfo(f'cluster leadership {"acquired" if leader else "lost"}', node=self.node_id)
+
+    async def run(self) -> None:
+        while True:
+            started = monotonic()
+            try:
+                await self._heartbeat()
+                await self._elect()
+            except Exception as e:
+                # without a renewed lease we must not keep polling as leader
+                self.is_leader = False
+                await self.logger.aerror(f'cluster heartbeat failed: {e}')
+            await asyncio.sleep(max(0.0, self.config.heartbeat_interval - (monotonic() - started)))
+
+    async def leave(self) -> None:
+        await self.redis.zrem(self.members_key, self.node_id)
+        await self._release(keys=[self.leader_key], args=[self.node_id])
+        self.is_leader = False
+
+    async def publish(self, sorted_gifts: list[dict], vip_only: bool) -> None:
+        await self.redis.xadd(
+            self.events_key,
+            {"gifts": json.dumps(sorted_gifts), "vip": int(vip_only), "ts": time()},
+            maxlen=1000, approximate=True
+        )
+
+    async def listen(self, handler: Callable[[list[dict], bool, float], Awaitable[None]]) -> None:
+        # every node reads every event and buys for its own shard of users
+        last_id = '$'
+        block_ms = int(self.config.event_block * 1000)
+        while True:
+            try:
+                response = await self.redis.xread({self.events_key: last_id}, block=block_ms, count=100)
+            except Exception as e:
+                await self.logger.aerror(f'cluster event read failed: {e}')
+                await asyncio.sleep(1)
+                continue
+
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    await handler(json.loads(fields["gifts"]), fields["vip"] == "1", float(fields["ts"]))
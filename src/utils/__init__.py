@@ -1,6 +1,11 @@
 from src.utils.util import DefaultUtils, CustomCall, CustomMessage, BalanceOperation
+from src.utils.throttling import Priority, PriorityRateLimiter, ThrottlingRequestMiddleware, RequestCancelled, api_priority, request_gate
+from src.utils.access import AccessControl, AccessMiddleware
+from src.utils.users import UserMiddleware
 
 __all__ = [
     "DefaultUtils", "CustomCall", "CustomMessage",
-    "BalanceOperation"
+    "BalanceOperation", "Priority", "PriorityRateLimiter",
+    "ThrottlingRequestMiddleware", "AccessControl", "AccessMiddleware",
+    "UserMiddleware", "api_priority", "request_gate", "RequestCancelled"
 ]
\ No newline at end of file
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.enums import ChatType
+from aiogram.types import CallbackQuery, Message, ReplyKeyboardRemove, TelegramObject, User
+
+
+class AccessControl:
+    """Whitelist and admins from users.json, read once and kept in memory.
+
+    All changes go through add/remove, which update the sets and rewrite the
+    file atomically, so handlers never touch the disk.
+    """
+
+    def __init__(self, path: str = "users.json", owner: Optional[int] = None) -> None:
+        self.path = path
+        self.owner = owner
+        self.whitelist: set[int] = set()
+        self.admins: set[int] = set()
+        self._lock = asyncio.Lock()
+
+    def load(self) -> "AccessControl":
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {"whitelist": [], "admins": []}
+            self._write(data)
+
+        self.whitelist = set(data.get("whitelist", []))
+        self.admins = set(data.get("admins", []))
+        return self
+
+    def _write(self, data: dict) -> None:
+        # write next to the target and rename over it, a crash never leaves half a file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".users.", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins or user_id == self.owner
+
+    def is_allowed(self, user_id: int) -> bool:
+        return user_id in self.whitelist or self.is_admin(user_id)
+
+    async def _update(self, whitelist: set[int]) -> None:
+        data = {"whitelist": sorted(whitelist), "admins": sorted(self.admins)}
+        await asyncio.to_thread(self._write, data)
+        self.whitelist = whitelist
+
+    async def add(self, user_id: int) -> bool:
+        async with self._lock:
+            if user_id in self.whitelist:
+                return False
+            await self._update(self.whitelist | {user_id})
+            return True
+
+    async def remove(self, user_id: int) -> bool:
+        async with self._lock:
+            if user_id not in self.whitelist:
+                return False
+            await self._update(self.whitelist - {user_id})
+            return True
+
+
+class AccessMiddleware(BaseMiddleware):
+    """Outer middleware: updates from users without access never reach the handlers.
+
+    The deny text only answers commands in private chats and callbacks, at most
+    once per `deny_interval` per user - anything else is dropped silently.
+    """
+
+    def __init__(self, access: AccessControl, deny_interval: float = 60.0) -> None:
+        self.access = access
+        self.deny_interval = deny_interval
+        self._denied: dict[int, float] = {} # user id -> last deny reply
+
+    def deny_text(self) -> str:
+        return (
+            f"❌ У Вас нет доступа к приватному боту\n\n"
+            f"На данный момент доступ имеет {len(self.access.whitelist)} человек"
+        )
+
+    def _should_reply(self, user_id: int) -> bool:
+        now = monotonic()
+        if now - self._denied.get(user_id, float('-inf')) < self.deny_interval:
+            return False
+        if len(self._denied) > 10000:
+            # a flood of strangers must not grow this forever
+            self._denied = {
+                _id: at for _id, at in self._denied.items() if now - at < self.deny_interval
+            }
+        self._denied[user_id] = now
+        return True
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+        ) -> Any:
+        data["access"] = self.access
+
+        # a payment that already went through must always be credited
+        if isinstance(event, Message) and event.successful_payment:
+            return await handler(event, data)
+
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None and self.access.is_allowed(user.id):
+            return await handler(event, data)
+        if user is None:
+            return
+
+        if isinstance(event, CallbackQuery):
+            # the button spinner must stop either way, the alert only now and then
+            if self._should_reply(user.id):
+                await event.answer(self.deny_text(), show_alert=True)
+            else:
+                await event.answer()
+        elif (
+            isinstance(event, Message)
+            and event.chat.type == ChatType.PRIVATE
+            and (event.text or '').startswith('/')
+            and self._should_reply(user.id)
+        ):
+            await event.answer(self.deny_text(), reply_markup=ReplyKeyboardRemove())
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, Iterator, Optional
+
+from structlog.typing import FilteringBoundLogger
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, GetUpdates, GetAvailableGifts, SendGift
+from aiogram.methods.base import Response, TelegramType
+
+
+class Priority(IntEnum):
+    PURCHASE = 0 # detection polls and send_gift
+    DEFAULT = 1 # handler replies, callbacks, invoices
+    COSMETIC = 2 # channel posts and notifications
+
+
+# overrides the per-method priority for calls made inside `api_priority`
+request_priority: ContextVar[Optional[Priority]] = ContextVar('request_priority', default=None)
+
+
+@contextmanager
+def api_priority(priority: Priority) -> Iterator[None]:
+    token = request_priority.set(priority)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+# awaited once the limiter granted the token, right before the call leaves;
+# false cancels the call without sending it (send_gift stamps its delivery here)
+request_gate: ContextVar[Optional[Callable[[], Awaitable[bool]]]] = ContextVar('request_gate', default=None)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class PriorityRateLimiter:
+    """Global token bucket, waiting callers are served lowest priority value first."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = count()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_take(self) -> bool:
+        now = monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float) -> None:
+        # nothing goes out for `seconds`, flood waits themselves are kept per method by the middleware
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self, priority: int = Priority.DEFAULT) -> None:
+        if not self._waiters and self._try_take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._release_loop())
+        await future
+
+    async def _release_loop(self) -> None:
+        while self._waiters:
+            if self._waiters[0][2].done(): # caller was cancelled
+                heapq.heappop(self._waiters)
+                continue
+
+            if self._try_take():
+                _, _, future = heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+
+            now = monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+            else:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ThrottlingRequestMiddleware(BaseRequestMiddleware):
+    """Every Bot API call goes through one limiter, flood waits are retried in place."""
+
+    priorities = {
+        GetAvailableGifts: Priority.PURCHASE,
+        SendGift: Priority.PURCHASE,
+    }
+    # long polling waits on the server side, never hold it in the queue
+    exempt = (GetUpdates,)
+
+    def __init__(self, limiter: PriorityRateLimiter, logger: FilteringBoundLogger, max_retries: int = 3) -> None:
+        self.limiter = limiter
+        self.logger = logger
+        self.max_retries = max_retries
+        # flood waits are per method: a sendGift flood must not stop the detection polls
+        self.paused_until: dict[type, float] = {}
+
+    async def _wait_flood(self, method: type) -> None:
+        delay = self.paused_until.get(method, 0.0) - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType]
+        ) -> Response[TelegramType]:
+        if isinstance(method, self.exempt):
+            return await make_request(bot, method)
+
+        # the caller knows best: the same send_message is a reply or a channel post
+        priority = request_priority.get()
+        if priority is None:
+            priority = self.priorities.get(type(method), Priority.DEFAULT)
+        gate = request_gate.get()
+        attempt = 0
+        while True:
+            # waits outside the limiter, the other methods keep the tokens meanwhile
+            await self._wait_flood(type(method))
+            await self.limiter.acquire(priority)
+            if gate is not None and not await gate():
+                raise RequestCancelled(f'{type(method).__name__} cancelled before it was sent')
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.paused_until[type(method)] = max(
+                    self.paused_until.get(type(method), 0.0), monotonic() + e.retry_after
+                )
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # back into the queue with the same priority
+                await self.logger.awarning(
+                    f'flood wait {e.retry_after}s on {type(method).__name__}, requeued',
+                    attempt=attempt
+                )
@@ -0,0 +1,19 @@
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+
+class UserMiddleware(BaseMiddleware):
+    """Loads the caller's database row once per update and passes it to handlers as `user`."""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+        ) -> Any:
+        from_user: Optional[User] = data.get("event_from_user")
+        bot = data["bot"]
+        data["user"] = await bot.database.get_cached_user(from_user.id) if from_user else None
+        return await handler(event, data)
@@ -0,0 +1,46 @@
+import asyncio
+
+from datetime import datetime
+
+from aiogram.types import Chat, Message, User
+
+from src.utils import AccessControl, AccessMiddleware
+
+
+class RecordingMessage(Message):
+    async def answer(self, text: str, **kwargs):
+        replies.append((self.chat.id, text))
+
+
+replies: list[tuple[int, str]] = []
+
+
+def message(text: str, chat_type: str = 'private', chat_id: int = 42) -> RecordingMessage:
+    return RecordingMessage(
+        message_id=1, date=datetime.now(), text=text,
+        chat=Chat(id=chat_id, type=chat_type), from_user=User(id=42, is_bot=False, first_name='stranger')
+    )
+
+
+def test_strangers_get_at_most_one_deny_reply(tmp_path):
+    access = AccessControl(str(tmp_path / 'users.json'), owner=1).load()
+    middleware = AccessMiddleware(access, deny_interval=60)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def run():
+        stranger = User(id=42, is_bot=False, first_name='stranger')
+        for event in (
+            message('hello'),                         # not a command - silent
+            message('/start', 'group', chat_id=-100), # group - silent
+            message('/start'),                        # replied
+            message('/start'),                        # within the interval - silent
+        ):
+            await middleware(handler, event, {"event_from_user": stranger})
+
+    replies.clear()
+    asyncio.run(run())
+    assert handled == []
+    assert len(replies) == 1 and replies[0][0] == 42
@@ -0,0 +1,50 @@
+import asyncio
+import sqlite3
+
+from types import SimpleNamespace
+
+from structlog import get_logger
+
+from src.background.recovery import recover_deliveries
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+
+
+# schema and rows as the baseline release left them: no migrations table,
+# a delivery row was inserted before the balance check
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, balance INTEGER, vip BOOLEAN, buying_mode INTEGER, buying_value INTEGER);
+CREATE TABLE invoices (invoice_id INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER, amount INTEGER, status BOOLEAN);
+CREATE TABLE gift_deliveries (id INTEGER PRIMARY KEY, gift_id INTEGER, user_id INTEGER, delivered BOOLEAN, created_at DATETIME);
+INSERT INTO users VALUES (1, 0, 0, 0, 0), (2, 500, 0, 0, 0);
+INSERT INTO gift_deliveries VALUES
+    (1, 100, 1, 0, '2025-01-01 00:00:00'),
+    (2, 100, 2, 1, '2025-01-01 00:00:00'),
+    (3, 200, 1, 0, '2025-01-02 00:00:00'),
+    (4, 200, 2, 0, '2025-01-02 00:00:00');
+"""
+
+
+def test_upgrade_drops_unpaid_baseline_deliveries(tmp_path):
+    path = tmp_path / 'baseline.sqlite'
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+
+    async def upgrade():
+        database = Database(DatabaseConfig(url=f'sqlite+aiosqlite:///{path}'))
+        try:
+            await database.init_db()
+            report = await recover_deliveries(SimpleNamespace(database=database), get_logger())
+            return report, await database.get_total_gifts(), await database.get_pending_deliveries(), \
+                [(user.id, user.balance) for user in [await database.get_user(1), await database.get_user(2)]]
+        finally:
+            await database.close()
+
+    report, total_gifts, pending, balances = asyncio.run(upgrade())
+
+    # nothing was ever paid for the undelivered rows: no gift appears, no star moves
+    assert report["pending"] == 0
+    assert report["assumed_delivered"] == 0
+    assert total_gifts == 1
+    assert pending == []
+    assert balances == [(1, 0), (2, 500)]
@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+
+from sqlalchemy import insert
+
+from src.background.planner import PLAN_DTYPE, in_plan_order, iter_batches, plan_purchases
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+from src.data.database.models import User
+
+
+def test_batches_keep_purchase_order():
+    rows = np.zeros(7, dtype=PLAN_DTYPE)
+    rows["user"] = [9, 2, 3, 1, 5, 6, 7]
+    rows["copies"] = [2, 2, 1, 2, 1, 1, 3]
+
+    batches = list(iter_batches(rows, chunk_size=4))
+
+    # one statement per copy count, not per change
+    assert batches == [
+        ([9, 2, 3, 1], [(1, [3]), (2, [9, 2, 1])]),
+        ([5, 6, 7], [(1, [5, 6]), (3, [7])]),
+    ]
+    # reservations come back in user id order, two copies for user 1
+    users, _ = batches[0]
+    reservations = [(10, 1), (11, 1), (12, 2), (13, 3), (14, 9)]
+    assert in_plan_order(users, reservations) == [(14, 9), (12, 2), (13, 3), (10, 1), (11, 1)]
+
+
+def test_sql_snapshot_matches_the_index(tmp_path):
+    async def run():
+        database = Database(DatabaseConfig(url=f'sqlite+aiosqlite:///{tmp_path / "snapshot.sqlite"}'))
+        try:
+            await database.init_db()
+            async with database.async_session() as session:
+                await session.execute(insert(User), [
+                    {"id": i, "balance": (i * 37) % 500, "vip": i % 7 == 0, "buying_mode": i % 3, "buying_value": 50}
+                    for i in range(1, 1001)
+                ])
+                await session.commit()
+            streamed = await database.get_user_snapshot(100, chunk_size=64)
+            await database.load_user_index()
+            return streamed, await database.get_user_snapshot(100)
+        finally:
+            await database.close()
+
+    streamed, indexed = asyncio.run(run())
+    assert [list(column) for column in streamed] == [list(column) for column in indexed]
+
+    gifts = [{"id": 1, "amount": 100, "supply": 50}, {"id": 2, "amount": 25, "supply": None}]
+    assert plan_purchases(streamed, gifts).tolist() == plan_purchases(indexed, gifts).tolist()
@@ -0,0 +1,189 @@
+import asyncio
+
+from functools import partial
+from types import SimpleNamespace
+from typing import Optional
+
+from sqlalchemy import insert
+
+from structlog import get_logger
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from src.background.gifts import deliver_gift, finish_purchase
+from src.background.pool import DeliveryJob, DeliveryPool, GiftRun
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+from src.data.database.models import User
+from src.utils import PriorityRateLimiter, ThrottlingRequestMiddleware
+
+
+class RecordingSession(BaseSession):
+    def __init__(self, errors: Optional[dict[int, type]] = None) -> None:
+        super().__init__()
+        self.calls = []
+        self.errors = errors or {} # user id -> exception class the call fails with
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        error = self.errors.get(getattr(method, 'user_id', None))
+        if error is not None:
+            raise error(method=method, message='boom')
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+async def ledger(tmp_path, name: str) -> Database:
+    database = Database(DatabaseConfig(url=f'sqlite+aiosqlite:///{tmp_path / name}'))
+    await database.init_db()
+    async with database.async_session() as session:
+        await session.execute(insert(User), [
+            {"id": 1, "balance": 100, "vip": False, "buying_mode": 0, "buying_value": 0},
+            {"id": 2, "balance": 100, "vip": False, "buying_mode": 0, "buying_value": 0},
+            {"id": 3, "balance": 100, "vip": False, "buying_mode": 0, "buying_value": 0},
+        ])
+        await session.commit()
+    return database
+
+
+def test_timed_out_deliveries_are_resolved_with_the_run(tmp_path):
+    async def run():
+        database = await ledger(tmp_path, 'pool.sqlite')
+        try:
+            reserved = dict(
+                (user_id, delivery_id)
+                for delivery_id, user_id in await database.reserve_gift_batch(7, 25, user_ids=[1, 2])
+            )
+
+            async def hanging_send(job: DeliveryJob) -> bool:
+                # user 1 hangs before the send, user 2 inside send_gift
+                if job.user_id == 2:
+                    await database.mark_dispatched(job.delivery_id)
+                await asyncio.sleep(10)
+                return True
+
+            pool = DeliveryPool(hanging_send, get_logger(), workers=2, call_timeout=0.2)
+            pool.start()
+            gift_run = GiftRun({"id": 7, "count": 100, "amount": 25})
+            for user_id, delivery_id in reserved.items():
+                await pool.submit(DeliveryJob(gift_run, delivery_id, user_id))
+            gift_run.seal()
+            await finish_purchase(SimpleNamespace(database=database), get_logger(), gift_run)
+            await pool.stop()
+
+            return (
+                gift_run.timed_out,
+                await database.get_pending_deliveries(),
+                await database.get_total_gifts(),
+                [(await database.get_user(user_id)).balance for user_id in (1, 2)]
+            )
+        finally:
+            await database.close()
+
+    timed_out, pending, total_gifts, balances = asyncio.run(run())
+    assert timed_out == 2
+    assert pending == []
+    # never dispatched - refunded; dispatched - assumed sent, like recovery does
+    assert total_gifts == 1
+    assert balances == [100, 75]
+
+
+def test_sends_still_waiting_for_the_limiter_are_refunded(tmp_path):
+    async def run():
+        database = await ledger(tmp_path, 'gate.sqlite')
+        session = RecordingSession()
+        bot = Bot('42:TEST', session=session)
+        bot.database = database
+        try:
+            limiter = PriorityRateLimiter(rate=100, burst=10)
+            session.middleware(ThrottlingRequestMiddleware(limiter, get_logger()))
+            [(delivery_id, user_id)] = await database.reserve_gift_batch(7, 25, user_ids=[1])
+
+            # a flood wait longer than the call timeout, the job never gets a token
+            limiter.pause(1.0)
+            pool = DeliveryPool(partial(deliver_gift, bot, get_logger()), get_logger(), workers=1, call_timeout=0.3)
+            pool.start()
+            gift_run = GiftRun({"id": 7, "count": 100, "amount": 25})
+            await pool.submit(DeliveryJob(gift_run, delivery_id, user_id))
+            gift_run.seal()
+            await finish_purchase(bot, get_logger(), gift_run)
+            await pool.stop()
+
+            return (
+                len(session.calls),
+                await database.get_total_gifts(),
+                (await database.get_user(1)).balance
+            )
+        finally:
+            await database.close()
+
+    calls, total_gifts, balance = asyncio.run(run())
+    assert calls == 0
+    assert total_gifts == 0
+    assert balance == 100
+
+
+def test_only_one_sender_claims_a_delivery(tmp_path):
+    async def run():
+        database = await ledger(tmp_path, 'claim.sqlite')
+        session = RecordingSession()
+        bot = Bot('42:TEST', session=session)
+        bot.database = database
+        try:
+            session.middleware(ThrottlingRequestMiddleware(PriorityRateLimiter(rate=100, burst=10), get_logger()))
+            [(delivery_id, user_id)] = await database.reserve_gift_batch(7, 25, user_ids=[1])
+
+            # the live job and a recovery resend of the same reservation
+            gift_run = GiftRun({"id": 7, "count": 100, "amount": 25})
+            job = DeliveryJob(gift_run, delivery_id, user_id)
+            sent = await asyncio.gather(*(deliver_gift(bot, get_logger(), job) for _ in range(2)))
+            return sorted(sent), len(session.calls)
+        finally:
+            await database.close()
+
+    sent, calls = asyncio.run(run())
+    assert sent == [False, True]
+    assert calls == 1
+
+
+def test_failed_sends_with_an_unknown_outcome_are_resolved_with_the_run(tmp_path):
+    async def run():
+        database = await ledger(tmp_path, 'unknown.sqlite')
+        session = RecordingSession({1: TelegramNetworkError, 2: TelegramServerError})
+        bot = Bot('42:TEST', session=session)
+        bot.database = database
+        try:
+            session.middleware(ThrottlingRequestMiddleware(PriorityRateLimiter(rate=100, burst=10), get_logger()))
+            reserved = await database.reserve_gift_batch(7, 25, user_ids=[1, 2, 3])
+
+            stamp = database.mark_dispatched
+            async def failing_stamp(delivery_id: int) -> bool:
+                if delivery_id == reserved[2][0]:
+                    raise ConnectionError('database went away')
+                return await stamp(delivery_id)
+            database.mark_dispatched = failing_stamp
+
+            gift_run = GiftRun({"id": 7, "count": 100, "amount": 25})
+            for delivery_id, user_id in reserved:
+                await deliver_gift(bot, get_logger(), DeliveryJob(gift_run, delivery_id, user_id))
+            gift_run.seal()
+            await finish_purchase(bot, get_logger(), gift_run)
+
+            return (
+                await database.get_pending_deliveries(),
+                [(await database.get_user(user_id)).balance for user_id in (1, 2, 3)]
+            )
+        finally:
+            await database.close()
+
+    pending, balances = asyncio.run(run())
+    assert pending == []
+    # sent and unanswered - assumed delivered, never stamped - refunded
+    assert balances == [75, 75, 100]
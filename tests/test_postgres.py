@@ -0,0 +1,132 @@
+import asyncio
+import os
+import random
+
+from time import monotonic
+
+import pytest
+
+from sqlalchemy import delete, func, insert, select
+
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+from src.data.database.models import GiftDelivery, User
+
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(
+    not DATABASE_URL.startswith('postgresql'), reason='needs DATABASE_URL pointing at a postgres database'
+)
+
+
+async def shared_ledger(nodes: int, users: int, balance: int) -> tuple[list[Database], list[int], int]:
+    # several Database objects on one postgres act like bot processes sharing the ledger
+    databases = [Database(DatabaseConfig(url=DATABASE_URL)) for _ in range(nodes)]
+    await databases[0].init_db()
+    first = random.randrange(10**12, 10**13)
+    user_ids = list(range(first, first + users))
+    async with databases[0].async_session() as session:
+        await session.execute(insert(User), [
+            {"id": _id, "balance": balance, "vip": False, "buying_mode": 0, "buying_value": 0} for _id in user_ids
+        ])
+        await session.commit()
+    return databases, user_ids, random.randrange(10**18, 2 * 10**18)
+
+
+async def drop_ledger(databases: list[Database], user_ids: list[int], gift_id: int) -> None:
+    async with databases[0].async_session() as session:
+        await session.execute(delete(GiftDelivery).where(GiftDelivery.gift_id == gift_id))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.commit()
+    for database in databases:
+        await database.close()
+
+
+async def ledger_state(database: Database, user_ids: list[int], gift_id: int) -> tuple[dict, dict]:
+    async with database.async_session() as session:
+        balances = dict((await session.execute(select(User.id, User.balance).where(User.id.in_(user_ids)))).all())
+        copies = dict((await session.execute(
+            select(GiftDelivery.user_id, func.count()).where(GiftDelivery.gift_id == gift_id).group_by(GiftDelivery.user_id)
+        )).all())
+    return balances, copies
+
+
+def test_concurrent_reservations_claim_every_user_once():
+    async def run():
+        databases, user_ids, gift_id = await shared_ledger(nodes=4, users=200, balance=1000)
+        try:
+            # every node reserves the same users several times at once, in different orders
+            calls = []
+            for database in databases:
+                for _ in range(3):
+                    batch = user_ids[:]
+                    random.shuffle(batch)
+                    calls.append(database.reserve_gift_batch(gift_id, 30, user_ids=batch, copies=2))
+            results = await asyncio.gather(*calls)
+            return results, *(await ledger_state(databases[0], user_ids, gift_id))
+        finally:
+            await drop_ledger(databases, user_ids, gift_id)
+
+    results, balances, copies = asyncio.run(run())
+    reserved = [row for result in results for row in result]
+    assert len({delivery_id for delivery_id, _ in reserved}) == len(reserved) == 400
+    # a user's two copies always come from one call
+    owners = [{user_id for _, user_id in result} for result in results]
+    assert sum(len(users) for users in owners) == len(set().union(*owners)) == 200
+    assert set(copies.values()) == {2}
+    assert set(balances.values()) == {1000 - 60}
+
+
+def test_locked_users_are_skipped_then_claimed():
+    async def run():
+        databases, user_ids, gift_id = await shared_ledger(nodes=2, users=20, balance=100)
+        try:
+            async with databases[0].engine.connect() as conn:
+                # another reservation holds the first user
+                transaction = await conn.begin()
+                await conn.execute(select(User.id).where(User.id == user_ids[0]).with_for_update())
+                started = monotonic()
+                reservation = asyncio.create_task(databases[1].reserve_gift_batch(gift_id, 25, user_ids=user_ids))
+                await asyncio.sleep(0.3)
+                _, copies = await ledger_state(databases[1], user_ids, gift_id)
+                await transaction.rollback()
+            reserved = await reservation
+            return copies, reserved, monotonic() - started, await ledger_state(databases[0], user_ids, gift_id)
+        finally:
+            await drop_ledger(databases, user_ids, gift_id)
+
+    copies_while_locked, reserved, took, (balances, copies) = asyncio.run(run())
+    # everyone else was claimed without waiting for the lock
+    assert len(copies_while_locked) == 19
+    # and the held user once it was free again
+    assert took >= 0.3
+    assert sorted(user_id for _, user_id in reserved) == sorted(balances)
+    assert set(copies.values()) == {1}
+    assert set(balances.values()) == {75}
+
+
+def test_a_conflicting_claim_is_retried_without_that_user():
+    async def run():
+        databases, user_ids, gift_id = await shared_ledger(nodes=2, users=20, balance=100)
+        try:
+            async with databases[0].engine.connect() as conn:
+                # a concurrent claim of the first user, committed while the batch is waiting on it
+                transaction = await conn.begin()
+                await conn.execute(insert(GiftDelivery).values(
+                    gift_id=gift_id, user_id=user_ids[0], copy=0, amount=25, delivered=False
+                ))
+                reservation = asyncio.create_task(databases[1].reserve_gift_batch(gift_id, 25, user_ids=user_ids))
+                await asyncio.sleep(0.3)
+                await transaction.commit()
+            reserved = await reservation
+            return user_ids, reserved, await ledger_state(databases[0], user_ids, gift_id)
+        finally:
+            await drop_ledger(databases, user_ids, gift_id)
+
+    user_ids, reserved, (balances, copies) = asyncio.run(run())
+    # the unique violation rolled the whole pass back, the retry left the claimed user alone
+    assert sorted(user_id for _, user_id in reserved) == user_ids[1:]
+    assert balances.pop(user_ids[0]) == 100
+    assert set(balances.values()) == {75}
+    assert set(copies.values()) == {1}
@@ -0,0 +1,26 @@
+import asyncio
+
+from structlog import get_logger
+
+from src.background.supervisor import supervise
+
+
+def test_crashed_stage_is_restarted():
+    runs = []
+
+    async def flaky_stage():
+        runs.append(len(runs))
+        if len(runs) < 3:
+            raise RuntimeError('boom')
+        await asyncio.Event().wait()
+
+    async def run():
+        task = asyncio.create_task(supervise('flaky', flaky_stage, get_logger(), max_backoff=0.01))
+        while len(runs) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    assert asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(runs) == 3
@@ -0,0 +1,61 @@
+import asyncio
+
+from time import monotonic
+
+from structlog import get_logger
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetAvailableGifts, SendGift, SendMessage
+
+from src.utils import Priority, PriorityRateLimiter, ThrottlingRequestMiddleware, api_priority
+
+
+class RecordingLimiter(PriorityRateLimiter):
+    def __init__(self) -> None:
+        super().__init__(rate=1000, burst=1000)
+        self.priorities = []
+
+    async def acquire(self, priority: int = Priority.DEFAULT) -> None:
+        self.priorities.append(priority)
+
+
+def test_replies_stay_default_and_announcements_are_cosmetic():
+    limiter = RecordingLimiter()
+    middleware = ThrottlingRequestMiddleware(limiter, get_logger())
+
+    async def make_request(bot, method):
+        return True
+
+    async def run():
+        await middleware(make_request, None, SendMessage(chat_id=1, text='reply'))
+        with api_priority(Priority.COSMETIC):
+            await middleware(make_request, None, SendMessage(chat_id=-100, text='post'))
+        await middleware(make_request, None, SendGift(user_id=1, gift_id='1'))
+
+    asyncio.run(run())
+    assert limiter.priorities == [Priority.DEFAULT, Priority.COSMETIC, Priority.PURCHASE]
+
+
+def test_a_send_flood_does_not_pause_detection_polls():
+    middleware = ThrottlingRequestMiddleware(PriorityRateLimiter(rate=1000, burst=10), get_logger())
+    sent = []
+
+    async def make_request(bot, method):
+        if isinstance(method, SendGift) and not sent:
+            sent.append(monotonic())
+            raise TelegramRetryAfter(method=method, message='flood', retry_after=1)
+        sent.append(monotonic())
+        return True
+
+    async def run():
+        started = monotonic()
+        send = asyncio.create_task(middleware(make_request, None, SendGift(user_id=1, gift_id='1')))
+        await asyncio.sleep(0.05)
+        await middleware(make_request, None, GetAvailableGifts())
+        polled = monotonic() - started
+        await send
+        return polled, monotonic() - started
+
+    polled, resent = asyncio.run(run())
+    assert polled < 0.5
+    assert resent >= 1
@@ -0,0 +1,88 @@
+import asyncio
+import random
+
+from sqlalchemy import insert, select
+
+from src.config.reader import DatabaseConfig
+from src.data.database import Database
+from src.data.database.index import UserIndex
+from src.data.database.models import User
+from src.utils import BalanceOperation
+
+
+def test_reload_keeps_writes_made_during_the_load(tmp_path):
+    async def run():
+        database = Database(DatabaseConfig(url=f'sqlite+aiosqlite:///{tmp_path / "index.sqlite"}'))
+        try:
+            await database.init_db()
+            async with database.async_session() as session:
+                await session.execute(insert(User), [
+                    {"id": i, "balance": 100, "vip": False, "buying_mode": 0, "buying_value": 0}
+                    for i in range(1, 2001)
+                ])
+                await session.commit()
+            await database.load_user_index()
+
+            async def top_ups():
+                for i in range(1, 2001, 10):
+                    await database.update_balance(i, 50, BalanceOperation.ADD)
+
+            # small chunks so the reload streams while the top-ups commit
+            await asyncio.gather(database.load_user_index(chunk_size=10), top_ups())
+
+            async with database.async_session() as session:
+                rows = (await session.execute(select(User.id, User.balance))).all()
+            return {_id: database.user_index.get(_id)[1] for _id, _ in rows}, dict(rows)
+        finally:
+            await database.close()
+
+    indexed, stored = asyncio.run(run())
+    assert indexed == stored
+
+
+def test_deferred_writes_match_a_plain_dict():
+    rng = random.Random(0)
+    users = {i: (i, rng.randrange(300), rng.random() < 0.2, 0, 0) for i in rng.sample(range(1, 500), 200)}
+    index = UserIndex()
+    index.load(list(zip(*users.values())))
+
+    for _ in range(2000):
+        action = rng.random()
+        _id = rng.randrange(1, 520)
+        if action < 0.4:
+            ids, delta = rng.sample(range(1, 520), 30), rng.choice((-25, -50, 10))
+            index.adjust_many(ids, delta)
+            for _id in set(ids) & users.keys():
+                row = users[_id]
+                users[_id] = (_id, row[1] + delta, *row[2:])
+        elif action < 0.7:
+            balance = rng.randrange(300)
+            index.upsert(_id, balance=balance)
+            users[_id] = (_id, balance, *users.get(_id, (_id, 0, False, 0, 0))[2:])
+        elif action < 0.8:
+            index.remove(_id)
+            users.pop(_id, None)
+        elif action < 0.9:
+            assert index.get(_id) == users.get(_id)
+        else:
+            min_balance = rng.randrange(300)
+            expected = sorted((row for row in users.values() if row[1] >= min_balance), key=lambda row: (row[1], row[0]))
+            assert [tuple(row) for row in zip(*index.snapshot(min_balance))] == expected
+
+    assert len(index) == len(users)
+    assert index.total_balance() == sum(row[1] for row in users.values())
+
+
+def test_writes_skip_an_index_that_was_never_loaded(tmp_path):
+    async def run():
+        database = Database(DatabaseConfig(url=f'sqlite+aiosqlite:///{tmp_path / "shared.sqlite"}'))
+        try:
+            await database.init_db()
+            await database.create_user(1, 100)
+            await database.update_balance(1, 50, BalanceOperation.ADD)
+            await database.reserve_gift_batch(7, 25, user_ids=[1])
+            return database.user_index.loaded, database.user_index.get(1), await database.get_user_count()
+        finally:
+            await database.close()
+
+    assert asyncio.run(run()) == (False, None, 1)